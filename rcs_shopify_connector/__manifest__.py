@@ -4,7 +4,7 @@
     'author': 'Reliution',
     'website': 'https://www.reliution.com/',
     'license': 'AGPL-3',
-    'version': '17.0.0.1',
+    'version': '17.0.0.2',
     'sequence': 0,
     "depends": ['base', 'sale_stock', 'sale_management', 'rcs_process_logs', 'product', 'stock_delivery'],
     "data": [
@@ -17,10 +17,14 @@
         'views/shopify_queue_manage_line_view.xml',
         'views/shopify_queue_manage_view.xml',
         'views/shopify_payment_gateway_views.xml',
+        'views/shopify_product_category_mapping_views.xml',
+        'views/shopify_retention_summary_views.xml',
+        'views/shopify_backfill_views.xml',
         'views/shopify_sale_order_process_configuration_views.xml',
         'views/sale_order_automation_views.xml',
         'views/shopify_product_template_view.xml',
         'views/shopify_product_product_view.xml',
+        'views/res_config_settings_views.xml',
         'views/shopify_menu.xml',
         'views/shopify_connector_view.xml',
         'views/res_partner_view.xml',
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    statistics = env['shopify.instance.statistics']
+    # Statistics are created with new instances, existing ones get theirs with their current backlog
+    for instance in env['shopify.connector'].with_context(active_test=False).search([('shopify_statistics_id', '=', False)]):
+        statistics._get_instance_statistics(instance).action_rebuild_statistics()
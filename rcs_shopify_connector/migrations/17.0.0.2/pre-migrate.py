@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import logging
+
+_logger = logging.getLogger(">>> Shopify Migration <<<")
+
+# Shopify IDs that become unique per instance: (table, Shopify ID column)
+SHOPIFY_UNIQUE_IDS = [
+    ('sale_order', 'shopify_order_id'),
+    ('sale_order_line', 'shopify_order_line_id'),
+    ('product_template', 'shopify_product_id'),
+    ('product_product', 'shopify_variant_id'),
+    ('res_partner', 'shopify_customer_id'),
+]
+
+
+def _column_exists(cr, table, column):
+    cr.execute("""
+        SELECT 1 FROM information_schema.columns
+         WHERE table_name = %s AND column_name = %s
+    """, [table, column])
+    return bool(cr.fetchone())
+
+
+def _clear_duplicate_shopify_ids(cr, table, column):
+    """
+        Keep the Shopify ID on the oldest record of each instance and clear it on the duplicates,
+        so the unique constraint can be created. Empty IDs are cleared as well.
+        :param table: Table holding the Shopify ID.
+        :param column: Column of the Shopify ID.
+    """
+    if not (_column_exists(cr, table, column) and _column_exists(cr, table, 'shopify_instance_id')):
+        return
+    cr.execute(f"UPDATE {table} SET {column} = NULL WHERE {column} = ''")
+    cr.execute(f"""
+        UPDATE {table} SET {column} = NULL
+         WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY shopify_instance_id, {column} ORDER BY id) AS position
+                  FROM {table}
+                 WHERE {column} IS NOT NULL
+            ) duplicates
+             WHERE position > 1
+         )
+         RETURNING id
+    """)
+    duplicate_ids = [row[0] for row in cr.fetchall()]
+    if duplicate_ids:
+        _logger.warning("Cleared %s on %d duplicate %s records: %s", column, len(duplicate_ids), table, duplicate_ids)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    for table, column in SHOPIFY_UNIQUE_IDS:
+        _clear_duplicate_shopify_ids(cr, table, column)
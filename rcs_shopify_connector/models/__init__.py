@@ -4,11 +4,17 @@ from . import product_template
 from . import product_product
 from . import product_attribute
 from . import product_category
+from . import shopify_product_image
 from . import sale_order
 from . import shopify_webhook
 from . import shopify_sale_order_process_configuration
 from . import shopify_payment_gateway
 from . import sale_order_automation
 from . import stock
+from . import shopify_location
 from . import shopify_queue
 from . import shopify_queue_line
+from . import shopify_instance_statistics
+from . import shopify_retention
+from . import shopify_backfill
+from . import res_config_settings
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class ProductAttribute(models.Model):
+    _inherit = "product.attribute"
+
+    is_shopify_attribute = fields.Boolean(string="Is Shopify Attribute", default=False)
+
+    @api.model
+    def _prefetch_shopify_attribute_values(self, products_data, cache):
+        """
+            Load or create every attribute and attribute value used by a chunk of Shopify products.
+            Lookups are done with one search per model and missing records are created in bulk,
+            attributes not always creating variants are never reused,
+            the result is kept in the given cache for the rest of the transaction.
+            :param products_data: List of Shopify product dictionaries.
+            :param cache: Dictionary holding 'attributes' (name -> product.attribute) and
+                          'values' ((attribute ID, name) -> product.attribute.value).
+            :return: The updated cache.
+        """
+        attribute_value_obj = self.env['product.attribute.value']
+        cache.setdefault('attributes', {})
+        cache.setdefault('values', {})
+
+        option_values = {}
+        for product_data in products_data:
+            for option in self._get_shopify_variant_options(product_data):
+                option_values.setdefault(option.get('name'), set()).update(option.get('values') or [])
+
+        missing_attribute_names = [name for name in option_values if name not in cache['attributes']]
+        if missing_attribute_names:
+            # Only attributes creating variants can hold the Shopify variants, Shopify attributes are preferred
+            for attribute in self.search([('name', 'in', missing_attribute_names), ('create_variant', '=', 'always')],
+                                         order='is_shopify_attribute desc, id'):
+                cache['attributes'].setdefault(attribute.name, attribute)
+            new_attribute_names = [name for name in missing_attribute_names if name not in cache['attributes']]
+            if new_attribute_names:
+                new_attributes = self.create([{
+                    'name': name,
+                    'create_variant': 'always',
+                    'is_shopify_attribute': True,
+                } for name in new_attribute_names])
+                for attribute in new_attributes:
+                    cache['attributes'][attribute.name] = attribute
+
+        missing_values = {}
+        for name, values in option_values.items():
+            attribute = cache['attributes'][name]
+            for value in values:
+                if (attribute.id, value) not in cache['values']:
+                    missing_values.setdefault(attribute, set()).add(value)
+        if missing_values:
+            attribute_ids = [attribute.id for attribute in missing_values]
+            value_names = list(set().union(*missing_values.values()))
+            for attribute_value in attribute_value_obj.search([('attribute_id', 'in', attribute_ids), ('name', 'in', value_names)]):
+                cache['values'].setdefault((attribute_value.attribute_id.id, attribute_value.name), attribute_value)
+            new_value_vals = [{'attribute_id': attribute.id, 'name': value}
+                              for attribute, values in missing_values.items()
+                              for value in values if (attribute.id, value) not in cache['values']]
+            if new_value_vals:
+                for attribute_value in attribute_value_obj.create(new_value_vals):
+                    cache['values'][(attribute_value.attribute_id.id, attribute_value.name)] = attribute_value
+        return cache
+
+    @api.model
+    def _get_shopify_variant_options(self, product_data):
+        """
+            Get the Shopify options generating variants, Shopify uses a single 'Title' option
+            with the 'Default Title' value for products without variants.
+            :param product_data: Dictionary containing Shopify product data.
+            :return: List of Shopify option dictionaries sorted by position.
+        """
+        options = product_data.get('options') or []
+        if len(options) == 1 and options[0].get('values') == ['Default Title']:
+            return []
+        return sorted(options, key=lambda option: option.get('position', 0))
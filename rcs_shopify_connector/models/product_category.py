@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+
+
+class ShopifyProductCategoryMapping(models.Model):
+    _name = "shopify.product.category.mapping"
+    _description = "Shopify Product Category Mapping"
+    _rec_name = "product_type"
+
+    product_type = fields.Char(string="Shopify Product Type", required=True)
+    categ_id = fields.Many2one('product.category', string="Product Category", required=True, ondelete="cascade")
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', required=True, ondelete="cascade")
+
+    _sql_constraints = [
+        ('product_type_instance_uniq', 'unique(shopify_instance_id, product_type)',
+         'A Shopify product type can only be mapped once per instance.'),
+    ]
+
+    @api.model
+    def _get_category_mapping(self, instance_id, cache):
+        """
+            Get the product type to category mapping of a Shopify instance, read once per transaction.
+            :param instance_id: ID of the Shopify instance.
+            :param cache: Dictionary shared by the chunks of a same transaction, filled with the mapping.
+            :return: Dictionary mapping Shopify product types to product.category IDs.
+        """
+        key = ('category_mapping', instance_id)
+        if key not in cache:
+            mappings = self.sudo().search_read([('shopify_instance_id', '=', instance_id)], ['product_type', 'categ_id'])
+            cache[key] = {mapping['product_type']: mapping['categ_id'][0] for mapping in mappings}
+        return cache[key]
+
+    @api.model
+    def _get_shopify_categories(self, products_data, instance_id, cache=None):
+        """
+            Resolve the product category of a chunk of Shopify products.
+            Unknown product types are mapped to an existing category of the same name or to a new one,
+            categories and mappings of the whole chunk are created in bulk.
+            :param products_data: List of Shopify product dictionaries.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param cache: Optional dictionary shared by the chunks of a same transaction.
+            :return: Dictionary mapping Shopify product types to product.category IDs.
+        """
+        category_obj = self.env['product.category']
+        category_mapping = self._get_category_mapping(instance_id.id, cache if cache is not None else {})
+        product_types = {product_data.get('product_type').strip() for product_data in products_data if (product_data.get('product_type') or '').strip()}
+        missing_product_types = product_types - set(category_mapping)
+        if not missing_product_types:
+            return category_mapping
+
+        parent_category = self.env.ref('product.product_category_all', raise_if_not_found=False) or category_obj
+        categories = {category.name: category.id for category in category_obj.search([('name', 'in', list(missing_product_types))], order='id desc')}
+        new_product_types = [product_type for product_type in missing_product_types if product_type not in categories]
+        if new_product_types:
+            new_categories = category_obj.create([{'name': product_type, 'parent_id': parent_category.id}
+                                                  for product_type in new_product_types])
+            categories.update({category.name: category.id for category in new_categories})
+        self.create([{
+            'product_type': product_type,
+            'categ_id': categories[product_type],
+            'shopify_instance_id': instance_id.id,
+        } for product_type in missing_product_types])
+        category_mapping.update({product_type: categories[product_type] for product_type in missing_product_types})
+        return category_mapping
@@ -2,19 +2,40 @@
 import requests
 import json
 import logging
+from collections import defaultdict
+from datetime import timedelta
 from odoo import models, fields, api, _
+from odoo.tools import float_compare, float_repr
+from odoo.tools.misc import split_every
 
 _LOGGER = logging.getLogger(">>> Shopify Import Product <<<")
 
+# Write dates are the start of their transaction, a change committed after a run can be older than its watermark
+PRODUCT_EXPORT_LOOKBACK = timedelta(hours=1)
+
 
 class ProductProduct(models.Model):
     _inherit = "product.product"
     _description = "Product Variant"
 
-    shopify_variant_id = fields.Char(string='Shopify Variant ID')
+    shopify_variant_id = fields.Char(string='Shopify Variant ID', copy=False)
     is_shopify_product = fields.Boolean(string="Is Shopify Product", default=False)
     shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', tracking=True)
     inventory_item_id = fields.Char(String="Inventory item ID")
+    shopify_price = fields.Float(string="Shopify Price", digits='Product Price', readonly=True, copy=False,
+                                 help="Price of the variant on Shopify at the last import or export")
+    shopify_synced_lst_price = fields.Float(string="Synced Sales Price", digits='Product Price', readonly=True, copy=False,
+                                            help="Sales price of the variant in Odoo at the last import or export, "
+                                                 "the price is only exported once it is changed in Odoo")
+    shopify_synced_barcode = fields.Char(string="Synced Barcode", readonly=True, copy=False,
+                                         help="Barcode of the variant on Shopify at the last import or export")
+    shopify_synced_sku = fields.Char(string="Synced SKU", readonly=True, copy=False,
+                                     help="SKU of the variant on Shopify at the last import or export")
+
+    _sql_constraints = [
+        ('shopify_variant_instance_uniq', 'unique(shopify_instance_id, shopify_variant_id)',
+         'A Shopify variant can only be linked to one product per instance.'),
+    ]
 
     def export_shopify_product(self, url, instance_id):
         """
@@ -36,19 +57,12 @@ class ProductProduct(models.Model):
         export_stock = []
         log_id = shopify_connection._create_common_process_log("Successfully exported stock to Shopify.", "product.product")
         _LOGGER.info("Starting stock export to Shopify for %d products.", len(products_to_export))
-        for product in products_to_export:
+        # One grouped quant query for every (variant, Shopify location) pair
+        stock_quantities = self.env['shopify.location']._get_shopify_stock_quantities(products_to_export, instance_id)
+        products_by_id = {product.id: product for product in products_to_export}
+        for (product_id, location_id), total_available_qty in stock_quantities.items():
+            product = products_by_id[product_id]
             try:
-                # Query stock.quant to get the available quantity for the product
-                quants = self.env['stock.quant'].sudo().search([
-                    ('product_id', '=', product.id),
-                    ('location_id', '=', instance_id.location_id.id)  # Adjust location filter as per your setup
-                ])
-                # Calculate total available quantity from all quants
-                total_available_qty = sum(quant.quantity for quant in quants)
-
-                # Fetch location ID from Shopify instance (assuming you have the correct setup)
-                location_id = product.shopify_instance_id.location_id.shopify_location_id
-
                 # Prepare payload with inventory item ID and updated stock quantity
                 payload = {
                     "location_id": location_id,
@@ -60,8 +74,8 @@ class ProductProduct(models.Model):
                 if response.status_code == 200:
                     response_data = response.json()
                     export_stock.append(response_data)
-                    _LOGGER.info("Successfully exported stock for product '%s' to Shopify.", product.name)
-                    log_line_id = shopify_connection._create_common_process_log_line(log_id, product.name, product,payload_json, f"Successfully imported {product.name} customer from Shopify.", 'success')
+                    _LOGGER.info("Successfully exported stock for product '%s' to Shopify location %s.", product.name, location_id)
+                    log_line_id = shopify_connection._create_common_process_log_line(log_id, product.name, product, payload_json, f"Successfully exported {product.name} stock to Shopify.", 'success')
                 else:
                     _LOGGER.error("Failed to export stock for product '%s'. HTTP Error: %d", product.name, response.status_code)
                     log_line_id = shopify_connection._create_common_process_log_line(log_id, product.name, product, payload_json, f"Failed to export stock. HTTP Error: {response.status_code}", 'error')
@@ -73,3 +87,125 @@ class ProductProduct(models.Model):
         notification = connector_obj._create_notification('Success', 'Export stock Process Completed', 'success')
         _LOGGER.info("Stock export process completed with %d products processed.", len(products_to_export))
         return notification
+
+    def _is_shopify_price_changed(self):
+        """
+            Check whether the sales price of the variant was changed in Odoo since the last sync and differs from Shopify.
+            Imported prices are not sent back, and the import keeps the per variant prices of Shopify
+            that Odoo cannot hold on a template price.
+            :return: True when the price has to be exported.
+        """
+        self.ensure_one()
+        precision = self.env['decimal.precision'].precision_get('Product Price')
+        return (float_compare(self.lst_price, self.shopify_synced_lst_price, precision_digits=precision) != 0
+                and float_compare(self.lst_price, self.shopify_price, precision_digits=precision) != 0)
+
+    @api.model
+    def _prepare_shopify_variant_bulk_input(self, variant, instance_id):
+        """
+            Prepare the productVariantsBulkUpdate input of a variant.
+            Only the values set in Odoo and different from the last synced ones are sent, so imported values
+            are not echoed back and an empty barcode or SKU never clears the one on Shopify.
+            :param variant: product.product record linked to a Shopify variant.
+            :param instance_id: Shopify Instance record containing Shopify access details.
+            :return: ProductVariantsBulkInput dictionary, empty when there is nothing to export.
+        """
+        variant_input = {}
+        if variant._is_shopify_price_changed():
+            precision = self.env['decimal.precision'].precision_get('Product Price')
+            variant_input['price'] = float_repr(variant.lst_price, precision)
+        if variant.barcode and variant.barcode != variant.shopify_synced_barcode:
+            variant_input['barcode'] = variant.barcode
+        if (variant.default_code and variant.default_code != variant.shopify_synced_sku
+                and instance_id.version_control >= '2024-04'):
+            variant_input['inventoryItem'] = {'sku': variant.default_code}
+        if variant_input:
+            variant_input['id'] = f"gid://shopify/ProductVariant/{variant.shopify_variant_id}"
+        return variant_input
+
+    def _export_shopify_variant_data(self, instance_id, batch_size=50):
+        """
+            Export the price and product data of variants to Shopify.
+            Variants are grouped per product, and the products of a batch are updated with one aliased
+            productVariantsBulkUpdate mutation, so a thousand variants take only a few calls.
+            :param instance_id: Shopify Instance record containing Shopify access details.
+            :param batch_size: Number of products updated per GraphQL call.
+            :return: True when every variant was exported.
+        """
+        shopify_connection = self.env['shopify.connector']
+        inputs_by_template = defaultdict(dict)
+        for variant in self:
+            variant_input = self._prepare_shopify_variant_bulk_input(variant, instance_id)
+            if variant_input:
+                inputs_by_template[variant.product_tmpl_id][variant] = variant_input
+        if not inputs_by_template:
+            return True
+
+        success = True
+        log_id = shopify_connection._create_common_process_log("Export product prices to Shopify.", "product.product")
+        for templates in split_every(batch_size, list(inputs_by_template)):
+            variables = {}
+            for template in templates:
+                variables[f"p{template.id}"] = f"gid://shopify/Product/{template.shopify_product_id}"
+                variables[f"v{template.id}"] = list(inputs_by_template[template].values())
+            mutation = "mutation (%s) {%s}" % (
+                ", ".join(f"$p{template.id}: ID!, $v{template.id}: [ProductVariantsBulkInput!]!" for template in templates),
+                "".join(f"t{template.id}: productVariantsBulkUpdate(productId: $p{template.id}, variants: $v{template.id}) "
+                        "{ productVariants { id } userErrors { field message } }" for template in templates))
+            try:
+                results = instance_id._shopify_graphql(mutation, variables)
+            except Exception as e:
+                success = False
+                _LOGGER.error("Failed to export product prices to Shopify: %s", str(e), exc_info=True)
+                for template in templates:
+                    shopify_connection._create_common_process_log_line(log_id, template.name, template, str(e), f"Failed to export {template.name} prices to Shopify.", 'error')
+                continue
+            for template in templates:
+                result = results.get(f"t{template.id}") or {}
+                if result.get('userErrors'):
+                    success = False
+                    shopify_connection._create_common_process_log_line(log_id, template.name, template, result, f"Failed to export {template.name} prices to Shopify: {result.get('userErrors')}", 'error')
+                else:
+                    for variant, variant_input in inputs_by_template[template].items():
+                        synced_vals = {}
+                        if 'price' in variant_input:
+                            synced_vals.update({'shopify_price': variant.lst_price, 'shopify_synced_lst_price': variant.lst_price})
+                        if 'barcode' in variant_input:
+                            synced_vals['shopify_synced_barcode'] = variant.barcode
+                        if 'inventoryItem' in variant_input:
+                            synced_vals['shopify_synced_sku'] = variant.default_code
+                        variant.write(synced_vals)
+                    shopify_connection._create_common_process_log_line(log_id, template.name, template, result, f"Successfully exported {template.name} prices to Shopify.", 'success')
+        _LOGGER.info("Exported %d variants in %d products to Shopify.",
+                     sum(len(inputs) for inputs in inputs_by_template.values()), len(inputs_by_template))
+        return success
+
+    @api.model
+    def cron_export_shopify_product_data(self):
+        """
+            Cron job method to export the variants changed since the watermark of each instance.
+            Prices live on the template, so a change on the variant or on its template selects the variant.
+            The watermark only moves forward when the whole export succeeded, failed variants are sent again.
+            The watermark starts when the instance is connected, so the catalog is never pushed back as a whole.
+            Variants are selected with a lookback margin since write dates are set when their transaction
+            starts, variants already in sync have nothing to send.
+        """
+        for instance_id in self.env['shopify.connector'].search([('state', '=', 'integrated')]):
+            run_date = fields.Datetime.now()
+            watermark = instance_id.shopify_product_export_watermark
+            if not watermark:
+                instance_id.shopify_product_export_watermark = run_date
+                self._cr.commit()
+                continue
+            domain = [('shopify_instance_id', '=', instance_id.id),
+                      ('shopify_variant_id', '!=', False),
+                      ('product_tmpl_id.shopify_product_id', '!=', False),
+                      '|', ('write_date', '>', watermark - PRODUCT_EXPORT_LOOKBACK),
+                      ('product_tmpl_id.write_date', '>', watermark - PRODUCT_EXPORT_LOOKBACK)]
+            variants = self.search(domain)
+            if variants and not variants._export_shopify_variant_data(instance_id):
+                self._cr.commit()
+                continue
+            instance_id.shopify_product_export_watermark = run_date
+            self._cr.commit()
+        return True
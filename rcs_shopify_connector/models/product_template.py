@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+from odoo import Command, models, fields, api, _
+import requests
+import logging
+from .shopify_queue_line import ShopifyTransientError, is_transient_status
+
+_logger = logging.getLogger(">>> Shopify Import Product <<<")
+
+
+class ProductTemplate(models.Model):
+    _inherit = "product.template"
+
+    is_shopify_product = fields.Boolean(string="Is Shopify Product", default=False)
+    shopify_product_id = fields.Char(string="Shopify Product ID", copy=False)
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', tracking=True)
+    inventory_item_id = fields.Char(string="Inventory item ID", compute='_compute_inventory_item_id')
+    log_count = fields.Integer(string='Product Logs', compute='_get_product_logs')
+    shopify_image_ids = fields.One2many('shopify.product.image', 'product_tmpl_id', string="Shopify Images")
+
+    _sql_constraints = [
+        ('shopify_product_instance_uniq', 'unique(shopify_instance_id, shopify_product_id)',
+         'A Shopify product can only be imported once per instance.'),
+    ]
+
+    @api.depends('product_variant_ids.inventory_item_id')
+    def _compute_inventory_item_id(self):
+        """
+           Show the inventory item ID of the variant on templates having a single variant.
+        """
+        for template in self:
+            if len(template.product_variant_ids) == 1:
+                template.inventory_item_id = template.product_variant_ids.inventory_item_id
+            else:
+                template.inventory_item_id = False
+
+    def _get_product_logs(self):
+        """
+           @usage: For count the related product log
+                   Method will assign total number of logs to field log_count
+        """
+        process_log = self.env['common.process.log']
+        for rec in self:
+            log_count = process_log._get_log_count(rec.id, 'product.template', rec.company_id.id, "shopify_connector")
+            rec.log_count = len(log_count)
+
+    def open_product_logs(self):
+        """
+            @usage: For open the Product logs
+            :return: action
+        """
+        process_log = self.env['common.process.log']
+        log_ids = process_log._get_log_count(self.id, 'product.template', self.company_id.id, "shopify_connector")
+        return process_log._open_logs_action(log_ids)
+
+    def _prepare_shopify_template_vals(self, product_data, instance_id):
+        """
+            Prepare product template values from Shopify product data.
+            :param product_data: Dictionary containing Shopify product data.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Dictionary of product template values.
+        """
+        vals = {
+            'name': product_data.get('title'),
+            'description_sale': product_data.get('body_html') or False,
+            'is_shopify_product': True,
+            'shopify_product_id': str(product_data.get('id')),
+            'shopify_instance_id': instance_id.id,
+        }
+        return vals
+
+    @api.model
+    def _prepare_shopify_new_template_vals(self, product_data):
+        """
+            Prepare the product template values only set when the product is created,
+            so the type and the sales price managed in Odoo are kept on later imports.
+            :param product_data: Dictionary containing Shopify product data.
+            :return: Dictionary of product template values.
+        """
+        variants = product_data.get('variants') or []
+        prices = [float(variant.get('price') or 0.0) for variant in variants]
+        return {
+            'detailed_type': 'product',
+            'list_price': min(prices) if prices else 0.0,
+        }
+
+    def _prepare_shopify_attribute_line_commands(self, product_data, cache):
+        """
+            Prepare the attribute line commands of a template from the Shopify options.
+            Existing lines of the template are extended with the missing values only.
+            :param product_data: Dictionary containing Shopify product data.
+            :param cache: Attribute cache filled by product.attribute._prefetch_shopify_attribute_values.
+            :return: List of ORM commands for attribute_line_ids.
+        """
+        attribute_obj = self.env['product.attribute']
+        commands = []
+        for option in attribute_obj._get_shopify_variant_options(product_data):
+            attribute = cache['attributes'][option.get('name')]
+            value_ids = [cache['values'][(attribute.id, value)].id for value in option.get('values') or []]
+            attribute_line = self.attribute_line_ids.filtered(lambda line: line.attribute_id == attribute)
+            if not attribute_line:
+                commands.append(Command.create({'attribute_id': attribute.id, 'value_ids': [Command.set(value_ids)]}))
+            else:
+                missing_value_ids = set(value_ids) - set(attribute_line.value_ids.ids)
+                if missing_value_ids:
+                    commands.append(Command.update(attribute_line.id, {'value_ids': [Command.link(value_id) for value_id in missing_value_ids]}))
+        return commands
+
+    def _map_shopify_variants(self, product_data, cache):
+        """
+            Map each Shopify variant of the product to the Odoo variant holding the same combination.
+            Variants are indexed by their attribute value IDs so every lookup is a dictionary access.
+            :param product_data: Dictionary containing Shopify product data.
+            :param cache: Attribute cache filled by product.attribute._prefetch_shopify_attribute_values.
+            :return: List of (shopify variant dictionary, product.product record) tuples.
+        """
+        attribute_obj = self.env['product.attribute']
+        options = attribute_obj._get_shopify_variant_options(product_data)
+        variants_by_combination = {
+            frozenset(variant.product_template_attribute_value_ids.product_attribute_value_id.ids): variant
+            for variant in self.product_variant_ids
+        }
+        mapped_variants = []
+        for shopify_variant in product_data.get('variants') or []:
+            if not options:
+                mapped_variants.append((shopify_variant, self.product_variant_ids[:1]))
+                continue
+            combination = set()
+            for index, option in enumerate(options):
+                attribute = cache['attributes'][option.get('name')]
+                value = shopify_variant.get('option%s' % (option.get('position') or index + 1))
+                if (attribute.id, value) in cache['values']:
+                    combination.add(cache['values'][(attribute.id, value)].id)
+            mapped_variants.append((shopify_variant, variants_by_combination.get(frozenset(combination), self.env['product.product'])))
+        return mapped_variants
+
+    def _prepare_shopify_variant_vals(self, shopify_variant, instance_id):
+        """
+            Prepare product variant values from Shopify variant data.
+            :param shopify_variant: Dictionary containing Shopify variant data.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Dictionary of product variant values.
+        """
+        return {
+            'shopify_variant_id': str(shopify_variant.get('id')),
+            'inventory_item_id': str(shopify_variant.get('inventory_item_id') or '') or False,
+            'default_code': shopify_variant.get('sku') or False,
+            'barcode': shopify_variant.get('barcode') or False,
+            'shopify_synced_barcode': shopify_variant.get('barcode') or False,
+            'shopify_synced_sku': shopify_variant.get('sku') or False,
+            'shopify_price': float(shopify_variant.get('price') or 0.0),
+            'is_shopify_product': True,
+            'shopify_instance_id': instance_id.id,
+        }
+
+    def _create_or_update_products(self, products_data, instance_id, cache=None):
+        """
+            Create or update a chunk of products from Shopify product data.
+            Templates are created with a single create call, attribute and attribute values are resolved
+            through an in-transaction cache and variants are matched on their combination.
+            :param products_data: List of dictionaries containing Shopify product data.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param cache: Optional attribute cache shared by the chunks of a same transaction.
+            :return: Dictionary mapping Shopify product IDs to product.template records.
+        """
+        shopify_connection = self.env['shopify.connector']
+        attribute_obj = self.env['product.attribute']
+        category_mapping_obj = self.env['shopify.product.category.mapping']
+        products_data = [product_data for product_data in products_data if product_data.get('id')]
+        if not products_data:
+            return {}
+        cache = cache if cache is not None else {}
+        attribute_obj._prefetch_shopify_attribute_values(products_data, cache)
+        categories = category_mapping_obj._get_shopify_categories(products_data, instance_id, cache)
+
+        shopify_product_ids = [str(product_data.get('id')) for product_data in products_data]
+        templates = {template.shopify_product_id: template for template in self.with_context(active_test=False).search(
+            [('shopify_product_id', 'in', shopify_product_ids), ('shopify_instance_id', '=', instance_id.id)])}
+
+        new_product_ids = set()
+        new_template_vals = []
+        for product_data in products_data:
+            shopify_product_id = str(product_data.get('id'))
+            template = templates.get(shopify_product_id)
+            vals = self._prepare_shopify_template_vals(product_data, instance_id)
+            product_type = (product_data.get('product_type') or '').strip()
+            if product_type in categories:
+                vals['categ_id'] = categories[product_type]
+            if template:
+                attribute_line_commands = template._prepare_shopify_attribute_line_commands(product_data, cache)
+                if attribute_line_commands:
+                    vals['attribute_line_ids'] = attribute_line_commands
+                changed_vals = shopify_connection._get_changed_vals(template, vals)
+                if changed_vals:
+                    template.write(changed_vals)
+            elif shopify_product_id not in new_product_ids:
+                vals.update(self._prepare_shopify_new_template_vals(product_data))
+                vals['attribute_line_ids'] = self._prepare_shopify_attribute_line_commands(product_data, cache)
+                new_product_ids.add(shopify_product_id)
+                new_template_vals.append(vals)
+        if new_template_vals:
+            new_templates = shopify_connection._create_unique_shopify_record('product.template', new_template_vals)
+            _logger.info("Created %d product templates from Shopify.", len(new_templates))
+            for template in new_templates:
+                templates[template.shopify_product_id] = template
+
+        log_id = shopify_connection._create_common_process_log(f"Successfully imported {len(products_data)} products from Shopify.", "product.template")
+        for product_data in products_data:
+            template = templates[str(product_data.get('id'))]
+            for shopify_variant, variant in template._map_shopify_variants(product_data, cache):
+                if not variant:
+                    _logger.warning("No variant found for Shopify variant %s of product %s.", shopify_variant.get('id'), template.name)
+                    shopify_connection._create_common_process_log_line(log_id, template.name, template, shopify_variant, f"No matching variant found for Shopify variant {shopify_variant.get('id')}.", 'error')
+                    continue
+                variant_vals = self._prepare_shopify_variant_vals(shopify_variant, instance_id)
+                # Odoo price of the variant matching the imported Shopify price, the export skips it until it changes
+                variant_vals['shopify_synced_lst_price'] = variant.lst_price
+                changed_vals = shopify_connection._get_changed_vals(variant, variant_vals)
+                if changed_vals:
+                    variant.write(changed_vals)
+            shopify_connection._create_common_process_log_line(log_id, template.name, template, product_data, f"Successfully imported {template.name} product from Shopify.", 'success')
+        # Images are downloaded later by the image fetch cron
+        self.env['shopify.product.image']._schedule_shopify_images(
+            [(templates[str(product_data.get('id'))], product_data) for product_data in products_data], instance_id)
+        return templates
+
+    def _create_or_update_product(self, product_data, instance_id):
+        """
+            Create or update a product based on Shopify product data.
+            :param product_data: Dictionary containing Shopify product data.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Updated or newly created product template record.
+        """
+        templates = self._create_or_update_products([product_data], instance_id)
+        return templates.get(str(product_data.get('id')), self.env['product.template'])
+
+    def import_product(self, url, instance_id):
+        """
+           Import products from Shopify using API.
+           :param url: Shopify API URL for fetching products.
+           :param instance_id: Shopify instance ID (shopify.connector record).
+           :return: Product template record for a single product, product queues for a product list.
+        """
+        shopify_connection = self.env['shopify.connector']
+        product_tmpl_obj = self.env['product.template']
+        product_id = None
+        headers = {
+            "X-Shopify-Access-Token": instance_id.shopify_access_token
+        }
+        try:
+            _logger.info("Fetching products from Shopify with URL: %s", url)
+            response = requests.get(url, headers=headers)
+            if response.status_code == 200:
+                products = response.json().get('products', [])
+                product = response.json().get('product', [])
+                if product:
+                    try:
+                        product_id = product_tmpl_obj._create_or_update_product(product, instance_id)
+                        return product_id
+                    except Exception as e:
+                        log_id = shopify_connection._create_common_process_log("Product import Failed", "product.template", product_id, product)
+                        log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', product_id, product, str(e), 'error')
+                        return product_tmpl_obj
+                else:
+                    if products:
+                        try:
+                            product_queue_ids = self.create_product_data_queues(products, instance_id)
+                            return product_queue_ids
+                        except Exception as e:
+                            log_id = shopify_connection._create_common_process_log("Product import Failed", "product.template", product_id, str(e))
+                            log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', product_id, str(e), str(e), 'error')
+                            return product_tmpl_obj
+            else:
+                if is_transient_status(response.status_code) and self.env.context.get('shopify_queue_processing'):
+                    raise ShopifyTransientError(f"Failed to fetch products from Shopify. HTTP Error: {response.status_code}")
+                log_id = shopify_connection._create_common_process_log("Failed to fetch products from Shopify.", "product.template", product_id, response.text)
+                log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', product_id, response.text, 'Failed to fetch products from Shopify', 'error')
+            return product_tmpl_obj
+        except requests.RequestException as e:
+            if self.env.context.get('shopify_queue_processing'):
+                raise ShopifyTransientError(str(e))
+            log_id = shopify_connection._create_common_process_log('An error occurred while fetching products from Shopify', "product.template", product_id, str(e))
+            log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', product_id, str(e), 'Error: Product import failed.', 'error')
+            return product_tmpl_obj
+
+    def create_product_data_queues(self, product_data, instance_id):
+        """
+            Create queues for product data import.
+            Args:
+                product_data (list): List of product data to be queued.
+                instance_id (int): ID of the Shopify instance.
+            Returns:
+                odoo.models.Model: Created product queues.
+        """
+        return self.env["shopify.queue"].create_data_queues(product_data, instance_id, "product")
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+from .shopify_retention import RETENTION_PARAMETERS
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = "res.config.settings"
+
+    shopify_retention_done_days = fields.Integer(
+        string="Done Queue Lines Retention", config_parameter=RETENTION_PARAMETERS['done_days'][0],
+        default=RETENTION_PARAMETERS['done_days'][1], help="Days before done queue lines are removed, 0 keeps them forever")
+    shopify_retention_cancel_days = fields.Integer(
+        string="Cancelled Queue Lines Retention", config_parameter=RETENTION_PARAMETERS['cancel_days'][0],
+        default=RETENTION_PARAMETERS['cancel_days'][1], help="Days before cancelled queue lines are removed, 0 keeps them forever")
+    shopify_retention_success_log_days = fields.Integer(
+        string="Successful Logs Retention", config_parameter=RETENTION_PARAMETERS['success_log_days'][0],
+        default=RETENTION_PARAMETERS['success_log_days'][1], help="Days before successful process logs are removed, 0 keeps them forever")
+    shopify_retention_error_log_days = fields.Integer(
+        string="Error Logs Retention", config_parameter=RETENTION_PARAMETERS['error_log_days'][0],
+        default=RETENTION_PARAMETERS['error_log_days'][1], help="Days before process logs with errors are removed, 0 keeps them forever")
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
-from odoo.tools.misc import split_every
 import requests
 import logging
+from .shopify_queue_line import ShopifyTransientError, is_transient_status
 
 _logger = logging.getLogger(">>> Shopify Import Customer <<<")
 
@@ -11,10 +11,15 @@ class ResPartner(models.Model):
     _inherit = "res.partner"
 
     is_shopify_customer = fields.Boolean(string="Is Shopify Customer", default=False)
-    shopify_customer_id = fields.Char(string="Shopify Customer ID", tracking=True)
+    shopify_customer_id = fields.Char(string="Shopify Customer ID", tracking=True, copy=False)
     shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', tracking=True)
     log_count = fields.Integer(string='Customer Logs', compute='_get_customer_logs', store=True)
 
+    _sql_constraints = [
+        ('shopify_customer_instance_uniq', 'unique(shopify_instance_id, shopify_customer_id)',
+         'A Shopify customer can only be imported once per instance.'),
+    ]
+
     @api.depends('shopify_customer_id')
     def _get_customer_logs(self):
         """
@@ -95,7 +100,7 @@ class ResPartner(models.Model):
         customer_id = None
         try:
             # Check if the customer already exists
-            existing_partner = self.search([('shopify_customer_id', '=', customer_data['id']),
+            existing_partner = self.with_context(active_test=False).search([('shopify_customer_id', '=', str(customer_data['id'])),
                                             ('shopify_instance_id', '=', instance_id.id)], limit=1)
             default_address = customer_data.get('default_address')
             state_id, country_id = self._get_country_or_state_id(default_address.get('province') if default_address else '', default_address.get('country_code') if default_address else '')
@@ -119,16 +124,22 @@ class ResPartner(models.Model):
                 'company_id': instance_id.company_id.id
             }
             if not existing_partner:
-                existing_partner = self.create(vals)
+                existing_partner = shopify_connection._create_unique_shopify_record('res.partner', vals)
                 _logger.info("Successfully created customer '%s' from Shopify.", name)
                 log_id = shopify_connection._create_common_process_log(f"Successfully created {name} customer from Shopify.", "res.partner", existing_partner, customer_data)
                 log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_partner, customer_data, f"Successfully imported {name} customer from Shopify.", 'success')
             else:
-                existing_partner.write(vals)
+                changed_vals = shopify_connection._get_changed_vals(existing_partner, vals)
+                if not changed_vals:
+                    _logger.info("Customer '%s' is unchanged on Shopify, nothing to update.", name)
+                    return existing_partner
+                existing_partner.write(changed_vals)
                 _logger.info("Successfully updated customer '%s' from Shopify.", name)
                 log_id = shopify_connection._create_common_process_log(f"Successfully update {name} customer from Shopify.", "res.partner", existing_partner, customer_data)
                 log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_partner, customer_data, f"Successfully updated {name} customer from Shopify.", 'success')
             return existing_partner
+        except ShopifyTransientError:
+            raise
         except Exception as e:
             _logger.error("An error occurred while creating or updating customer with Shopify ID '%s': %s", str(e), exc_info=True)
             log_id = shopify_connection._create_common_process_log('An error occurred while creating customers from Shopify', "res.partner", customer_id, str(e))
@@ -150,10 +161,12 @@ class ResPartner(models.Model):
         }
         try:
             _logger.info("Fetching customers from Shopify with URL: %s", url)
-            response = requests.get(url, headers=headers)
+            response = requests.get(url, headers=headers, params=shopify_connection._get_shopify_projection_params('customers'))
             if response.status_code == 200:
                 customers = response.json().get('customers', [])
                 customer = response.json().get('customer', [])
+                if customer:
+                    customer = shopify_connection._project_shopify_data('customers', customer)
                 if customer:
                     try:
                         _logger.info("Processing single customer data: %s", customer)
@@ -173,10 +186,14 @@ class ResPartner(models.Model):
                             log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', customer_id, customer, str(e), 'error')
                             return partner_obj
             else:
+                if is_transient_status(response.status_code) and self.env.context.get('shopify_queue_processing'):
+                    raise ShopifyTransientError(f"Failed to fetch customers from Shopify. HTTP Error: {response.status_code}")
                 log_id = shopify_connection._create_common_process_log(f"Failed to fetch customers from Shopify.", "res.partner", customer_id, response.text)
                 log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', customer_id,  response.text, 'Failed to fetch customers from Shopify', 'error')
                 return partner_obj
         except requests.RequestException as e:
+            if self.env.context.get('shopify_queue_processing'):
+                raise ShopifyTransientError(str(e))
             log_id = shopify_connection._create_common_process_log('An error occurred while fetching customers from Shopify', "res.partner", customer_id, str(e))
             log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', customer_id, str(e), 'Error: Customer import failed.', 'error')
             return partner_obj
@@ -188,16 +205,7 @@ class ResPartner(models.Model):
                 customer_data (list): List of customer data to be queued.
                 instance_id (int): ID of the Shopify instance.
             Returns:
-                list: List of created customer queue IDs.
+                odoo.models.Model: Created customer queues.
         """
-        customer_queue_list = []
-        customer_data_queue_obj = self.env["shopify.queue"]
-        customer_data_queue_line_obj = self.env["shopify.queue.line"]
-
-        if len(customer_data) > 0:
-            for customer_id_chunk in split_every(125, customer_data):
-                customer_queue = customer_data_queue_obj.create_queue(instance_id, "res_partner")
-                customer_data_queue_line_obj.shopify_create_multi_queue(customer_queue, customer_id_chunk, instance_id, 'res_partner')
-                customer_queue_list.append(customer_queue.id)
-            self._cr.commit()
-        return customer_data_queue_obj.search([('id', 'in', customer_queue_list)])
\ No newline at end of file
+        customer_data = [self.env['shopify.connector']._project_shopify_data('customers', customer) for customer in customer_data]
+        return self.env["shopify.queue"].create_data_queues(customer_data, instance_id, "res_partner")
\ No newline at end of file
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 import time
+import json
+import hashlib
 import requests
 import logging
+from collections import defaultdict
+from datetime import timedelta
 from pytz import utc
 from odoo import Command, _, api, fields, models
 from dateutil import parser
 from odoo.tools.misc import split_every
+from .shopify_queue_line import ShopifyTransientError, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from .shopify_queue import SHOPIFY_IMPORT_CONTEXT
 
 _logger = logging.getLogger(">>> Shopify Import Orders <<<")
 
@@ -15,10 +21,24 @@ class SaleOrder(models.Model):
 
     is_shopify_order = fields.Boolean(string='Is Shopify Order', default=False)
     shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', tracking=True)
-    shopify_order_id = fields.Char(string='Shopify Order ID', tracking=True)
+    shopify_order_id = fields.Char(string='Shopify Order ID', tracking=True, copy=False)
     log_count = fields.Integer(string='Sale Order Logs', compute='_get_sale_order_logs', store=True)
     shopify_payment_gateway_id = fields.Many2one("shopify.payment.gateway", string="Shopify Payment Gateway", ondelete="restrict")
-
+    shopify_automation_id = fields.Many2one("sale.order.automation", string="Shopify WorkFlow Automation", copy=False)
+    shopify_fulfillment_status = fields.Char(string="Shopify Fulfillment Status", copy=False)
+    shopify_automation_state = fields.Selection([('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')],
+                                                string="Automation State", copy=False, index=True)
+    shopify_updated_at = fields.Datetime(string="Shopify Updated On", copy=False, readonly=True)
+    shopify_fingerprint = fields.Char(string="Shopify Payload Fingerprint", copy=False, readonly=True,
+                                      help="SHA-1 of the last Shopify order payload applied to this order")
+    shopify_automation_retry_count = fields.Integer(string="Automation Retries", default=0, copy=False)
+    shopify_automation_next_attempt = fields.Datetime(string="Next Automation Attempt", copy=False, readonly=True,
+                                                      help="Failed automations are retried with an exponential backoff")
+
+    _sql_constraints = [
+        ('shopify_order_instance_uniq', 'unique(shopify_instance_id, shopify_order_id)',
+         'A Shopify order can only be imported once per instance.'),
+    ]
 
     @api.depends('shopify_order_id')
     def _get_sale_order_logs(self):
@@ -54,6 +74,62 @@ class SaleOrder(models.Model):
             date_order = str(date_order)
         return date_order
 
+    def _convert_shopify_datetime(self, value):
+        """
+            Convert a Shopify ISO 8601 datetime to a naive UTC datetime.
+            :param value: Datetime string sent by Shopify.
+            :return: datetime or False.
+        """
+        if not value:
+            return False
+        return parser.parse(value).astimezone(utc).replace(tzinfo=None)
+
+    @api.model
+    def _get_shopify_fingerprint(self, order):
+        """
+            Compute the fingerprint of a Shopify order payload.
+            Only the projected fields are hashed, so full webhook payloads and projected fetches agree.
+            :param order: Dictionary containing Shopify order data.
+            :return: SHA-1 hex digest of the canonical JSON of the payload.
+        """
+        order = self.env['shopify.connector']._project_shopify_data('orders', order)
+        return hashlib.sha1(json.dumps(order, sort_keys=True, default=str).encode()).hexdigest()
+
+    @api.model
+    def _filter_unchanged_shopify_orders(self, orders, instance_id):
+        """
+            Drop the Shopify orders already applied in Odoo.
+            An order is skipped when its fingerprint matches the stored one or when it is older than
+            the stored Shopify update date, which covers overlapping pulls and webhook replays.
+            When only the update date moved, it is stored so the order is not seen as stale again.
+            :param orders: List of Shopify order dictionaries.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: List of the orders that still have to be imported.
+        """
+        shopify_order_ids = [str(order.get('id')) for order in orders if order.get('id')]
+        if not shopify_order_ids:
+            return orders
+        applied_orders = {
+            applied['shopify_order_id']: applied for applied in self.with_context(active_test=False).search_read(
+                [('shopify_instance_id', '=', instance_id.id), ('shopify_order_id', 'in', shopify_order_ids)],
+                ['shopify_order_id', 'shopify_fingerprint', 'shopify_updated_at'])
+        }
+        changed_orders = []
+        for order in orders:
+            applied = applied_orders.get(str(order.get('id')))
+            if applied:
+                updated_at = self._convert_shopify_datetime(order.get('updated_at'))
+                if applied['shopify_fingerprint'] == self._get_shopify_fingerprint(order):
+                    if updated_at and (not applied['shopify_updated_at'] or updated_at > applied['shopify_updated_at']):
+                        self.browse(applied['id']).write({'shopify_updated_at': updated_at})
+                    continue
+                if updated_at and applied['shopify_updated_at'] and updated_at < applied['shopify_updated_at']:
+                    continue
+            changed_orders.append(order)
+        if len(changed_orders) < len(orders):
+            _logger.info("Skipped %d unchanged Shopify orders.", len(orders) - len(changed_orders))
+        return changed_orders
+
     def _get_partner_id(self, shopify_customer_id, instance_id):
         """
             Retrieve partner ID based on Shopify customer ID and instance.
@@ -83,10 +159,13 @@ class SaleOrder(models.Model):
         """
         sale_order = self.env['sale.order']
         shopify_connection = self.env['shopify.connector']
+        name = order.get('name')
+        res_id = None
         try:
             financial_status = order.get('financial_status')
             fulfillment_status = order.get('fulfillment_status')
             payment_gateway_name = order.get('payment_gateway_names') if order.get('payment_gateway_names') else ['no_payment_gateway']
+            self.env['shopify.payment.gateway']._register_shopify_gateway_names(payment_gateway_name, instance_id)
             # Fetch automation settings based on financial status and instance
             automation_settings = self._get_automation_settings(instance_id, financial_status, payment_gateway_name[0])
             payment_term_id = automation_settings.account_payment_term_id.id if automation_settings else False
@@ -123,7 +202,8 @@ class SaleOrder(models.Model):
 
                     }
                     existing_order = self.search(
-                        [('shopify_order_id', '=', shopify_order_id), ('shopify_instance_id', '=', instance_id.id)], limit=1)
+                        [('shopify_order_id', '=', str(shopify_order_id)), ('shopify_instance_id', '=', instance_id.id)], limit=1)
+                    is_new_order = not existing_order
 
                     if existing_order:
                         _logger.info("Found existing order: %s", existing_order.name)
@@ -137,19 +217,41 @@ class SaleOrder(models.Model):
                             log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_order, order, f"Successfully updated {name} order from Shopify.", 'success')
                             _logger.info(f"Successfully update {name} order from Shopify.", order)
                     else:
-                        existing_order = self.create(sale_order_vals)
+                        existing_order = shopify_connection._create_unique_shopify_record('sale.order', sale_order_vals)
                         log_id = shopify_connection._create_common_process_log(f"Successfully created {name} order from Shopify.", "sale.order", existing_order, order)
                         log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_order, order, f"Successfully created {name} order from Shopify.", 'success')
                         _logger.info(f"Successfully created {name} order from Shopify.", order)
 
                     line_items = order.get('line_items')
+                    lines_complete = True
                     if existing_order.state not in ["sale", "cancel"]:
                         _logger.info("Creating or updating sale order lines for order: %s", existing_order.name)
-                        order_line = self._create_sale_order_line(existing_order, line_items, taxes_included,  instance_id, log_id, order)
-
-                    if automation_settings:
-                        _logger.info("Processing automation settings for order: %s", existing_order.name)
-                        self._process_automation_settings(existing_order, automation_settings.rcs_sale_order_automation_id, fulfillment_status)
+                        order_line, lines_complete = self._create_sale_order_line(existing_order, line_items, taxes_included,  instance_id, log_id, order)
+
+                    applied_vals = {}
+                    if lines_complete:
+                        # A partially imported order keeps its old fingerprint so the next update is applied again
+                        applied_vals.update({
+                            'shopify_updated_at': self._convert_shopify_datetime(order.get('updated_at')),
+                            'shopify_fingerprint': self._get_shopify_fingerprint(order),
+                        })
+                    automation_id = automation_settings.rcs_sale_order_automation_id if automation_settings else False
+                    # Re-imports of an order only re-arm the automation when its input changed, so finished
+                    # orders are not automated again and failed orders keep their retry budget
+                    if automation_id and (is_new_order
+                                          or existing_order.shopify_automation_id != automation_id
+                                          or existing_order.shopify_fulfillment_status != fulfillment_status):
+                        # Automation runs in its own pipeline stage, see cron_process_shopify_automation
+                        _logger.info("Scheduling automation settings for order: %s", existing_order.name)
+                        applied_vals.update({
+                            'shopify_automation_id': automation_settings.rcs_sale_order_automation_id.id,
+                            'shopify_fulfillment_status': fulfillment_status,
+                            'shopify_automation_state': 'pending',
+                            'shopify_automation_retry_count': 0,
+                            'shopify_automation_next_attempt': False,
+                        })
+                    if applied_vals:
+                        existing_order.write(applied_vals)
 
                     if kwargs.get('record'):
                         kwargs.get('record').state = 'done'
@@ -177,12 +279,17 @@ class SaleOrder(models.Model):
                     return sale_order
                 else:
                     return sale_order
+        except ShopifyTransientError:
+            raise
         except Exception as e:
             # Log the exception
             _logger.error("Exception occurred while processing order from Shopify: %s, Exception: %s", name, str(e), exc_info=True)
             log_id = shopify_connection._create_common_process_log(
                 f"Exception occurred while processing {name} order from Shopify.", "sale.order", res_id, str(e))
             log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', res_id, str(e), f"Exception occurred while processing {name} order from Shopify.", 'error')
+            if kwargs.get('record'):
+                kwargs.get('record').state = 'cancel'
+            return sale_order
 
 
     def _get_automation_settings(self, instance_id, financial_status, payment_gateway_name):
@@ -212,39 +319,148 @@ class SaleOrder(models.Model):
         :param fulfillment_status: Status of the fulfillment ('fulfilled' or other).
         """
         _logger.info("Processing automation settings for sale order %s with fulfillment status '%s'", sale_order.name, fulfillment_status)
-        invoice = None
+        self._process_automation_settings_batch([(sale_order, automation_settings, fulfillment_status)])
 
-        if sale_order.state == "draft" and automation_settings.is_confirm_order:
-            _logger.info("Confirming sale order %s", sale_order.name)
-            sale_order.action_confirm()
+    def _process_automation_settings_batch(self, automation_batch):
+        """
+        Process automation settings for a chunk of sale orders.
+        Orders are grouped by automation configuration and every workflow step runs once per group.
+        :param automation_batch: List of (sale_order, automation_settings, fulfillment_status) tuples.
+        :return: Sale order records whose automation failed.
+        """
+        failed_orders = self.env['sale.order']
+        sale_order_obj = self.env['sale.order']
+        automation_groups = defaultdict(lambda: [sale_order_obj, sale_order_obj])
+        for sale_order, automation_settings, fulfillment_status in automation_batch:
+            automation_groups[automation_settings][0] |= sale_order
+            if fulfillment_status == "fulfilled":
+                automation_groups[automation_settings][1] |= sale_order
 
-        if fulfillment_status == "fulfilled" and not sale_order.picking_ids.filtered(lambda p: p.state == 'done'):
-            _logger.info("Validating delivery for sale order %s", sale_order.name)
-            self.validate_delivery(sale_order, automation_settings)
+        for automation_settings, (sale_orders, fulfilled_orders) in automation_groups.items():
+            try:
+                with self.env.cr.savepoint():
+                    self._process_automation_settings_group(sale_orders, automation_settings, fulfilled_orders)
+            except Exception as e:
+                # A single faulty order must not block the rest of its group
+                _logger.warning("Batch automation failed for %s, falling back to order by order: %s", automation_settings.name, str(e))
+                for sale_order in sale_orders:
+                    try:
+                        with self.env.cr.savepoint():
+                            self._process_automation_settings_group(sale_order, automation_settings, fulfilled_orders & sale_order)
+                    except Exception as e:
+                        _logger.error("Failed to process automation settings for sale order %s: %s", sale_order.name, str(e), exc_info=True)
+                        failed_orders |= sale_order
+        return failed_orders
 
-        if automation_settings.is_create_invoice and sale_order.state in ['sale', 'cancel']:
-            if sale_order.invoice_status != 'invoiced':
-                _logger.info("Creating invoices for sale order %s", sale_order.name)
-                invoice = sale_order.with_context(default_journal_id=automation_settings.sale_journal_id.id)._create_invoices()
-            else:
-                invoice = sale_order.invoice_ids.filtered(lambda inv: inv.state != 'cancel')[0] if sale_order.invoice_ids else None
-                _logger.info("Existing invoice found for sale order %s", sale_order.name)
+    def _process_automation_settings_group(self, sale_orders, automation_settings, fulfilled_orders):
+        """
+        Run the workflow steps of one automation configuration on a recordset of sale orders.
+        :param sale_orders: Sale order records sharing the automation settings.
+        :param automation_settings: Automation settings record (sale.order.automation).
+        :param fulfilled_orders: Subset of sale_orders that are fulfilled on Shopify.
+        """
+        if automation_settings.is_confirm_order:
+            orders_to_confirm = sale_orders.filtered(lambda order: order.state == "draft")
+            if orders_to_confirm:
+                _logger.info("Confirming %d sale orders", len(orders_to_confirm))
+                orders_to_confirm.action_confirm()
+
+        fulfilled_orders = fulfilled_orders.filtered(lambda order: not order.picking_ids.filtered(lambda p: p.state == 'done'))
+        if fulfilled_orders:
+            _logger.info("Validating deliveries for %d sale orders", len(fulfilled_orders))
+            self._validate_deliveries(fulfilled_orders, automation_settings)
+
+        invoices = self.env['account.move']
+        if automation_settings.is_create_invoice:
+            invoiced_orders = sale_orders.filtered(lambda order: order.state in ['sale', 'cancel'])
+            orders_to_invoice = invoiced_orders.filtered(lambda order: order.invoice_status != 'invoiced')
+            invoices = (invoiced_orders - orders_to_invoice).invoice_ids.filtered(lambda inv: inv.state != 'cancel')
+            if orders_to_invoice:
+                _logger.info("Creating invoices for %d sale orders", len(orders_to_invoice))
+                invoices |= orders_to_invoice.with_context(default_journal_id=automation_settings.sale_journal_id.id)._create_invoices(grouped=True)
+
+        if invoices and automation_settings.is_validate_invoice:
+            invoices_to_post = invoices.filtered(lambda inv: inv.state == 'draft')
+            if invoices_to_post:
+                _logger.info("Validating %d invoices", len(invoices_to_post))
+                invoices_to_post.action_post()
+
+        if invoices and automation_settings.is_register_payment:
+            invoices_to_pay = invoices.filtered(lambda inv: inv.state == 'posted' and inv.payment_state in ["not_paid", "partial"] and inv.amount_residual != 0)
+            if invoices_to_pay:
+                _logger.info("Registering payment for %d invoices", len(invoices_to_pay))
+                self._register_payment(invoices_to_pay, automation_settings)
 
-        if invoice and automation_settings.is_validate_invoice and invoice.state == 'draft':
-            _logger.info("Validating invoice %s", invoice.name)
-            invoice.action_post()
+        if automation_settings.is_order_date_same_as_invoice_date:
+            for sale_order in sale_orders:
+                sale_order.invoice_ids.filtered(lambda inv: inv.state != 'cancel').write({'invoice_date': sale_order.date_order})
 
-        if invoice and invoice.payment_state in ["not_paid", "partial"] and invoice.amount_residual != 0 and automation_settings.is_register_payment:
-            _logger.info("Registering payment for invoice %s", invoice.name)
-            self._register_payment(invoice, automation_settings)
+        if automation_settings.is_lock_order:
+            orders_to_lock = sale_orders.filtered(lambda order: order.state == 'sale' and not order.locked)
+            if orders_to_lock:
+                _logger.info("Locking %d sale orders", len(orders_to_lock))
+                orders_to_lock.action_lock()
 
-        if automation_settings.is_order_date_same_as_invoice_date:
-            _logger.info("Updating invoice date to sale order date for sale order %s", sale_order.name)
-            sale_order.invoice_ids.filtered(lambda inv: inv.state != 'cancel').write({'invoice_date': sale_order.date_order})
+    def _claim_shopify_automation_orders(self, order_ids):
+        """
+            Lock the given pending orders so parallel automation workers never process the same order twice.
+            :param order_ids: List of sale order IDs.
+            :return: Sale order records claimed by the current transaction.
+        """
+        if not order_ids:
+            return self.env['sale.order']
+        self.env.cr.execute("""
+            SELECT id FROM sale_order
+             WHERE id IN %s AND shopify_automation_state = 'pending'
+               FOR UPDATE SKIP LOCKED
+        """, [tuple(order_ids)])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def cron_process_shopify_automation(self, batch_size=100, max_retries=3):
+        """
+            Cron job method to run the post-import automation stage of Shopify orders.
+            Pending orders are claimed in batches, automated per configuration and committed batch by batch.
+            Failed orders are retried with an exponential backoff and marked as failed after max_retries attempts.
+            :param batch_size: Number of orders processed per transaction.
+            :param max_retries: Number of attempts before an order is marked as failed.
+        """
+        self = self.with_context(**SHOPIFY_IMPORT_CONTEXT)
+        shopify_connection = self.env['shopify.connector']
+        pending_order_ids = self.search([('shopify_automation_state', '=', 'pending'),
+                                         '|', ('shopify_automation_next_attempt', '=', False),
+                                         ('shopify_automation_next_attempt', '<=', fields.Datetime.now())], order='id').ids
+        _logger.info("Processing automation settings for %d pending Shopify orders", len(pending_order_ids))
+        for order_ids in split_every(batch_size, pending_order_ids):
+            sale_orders = self._claim_shopify_automation_orders(list(order_ids))
+            if not sale_orders:
+                continue
+            automation_batch = [(order, order.shopify_automation_id, order.shopify_fulfillment_status) for order in sale_orders]
+            failed_orders = self._process_automation_settings_batch(automation_batch)
+            (sale_orders - failed_orders).write({'shopify_automation_state': 'done'})
+            for order in failed_orders:
+                retry_count = order.shopify_automation_retry_count + 1
+                delay = min(RETRY_BASE_DELAY * 2 ** (retry_count - 1), RETRY_MAX_DELAY)
+                order.write({
+                    'shopify_automation_retry_count': retry_count,
+                    'shopify_automation_state': 'failed' if retry_count >= max_retries else 'pending',
+                    'shopify_automation_next_attempt': fields.Datetime.now() + timedelta(seconds=delay),
+                })
+                if retry_count >= max_retries:
+                    log_id = shopify_connection._create_common_process_log(f"Failed to process workflow automation of {order.name} order.", "sale.order", order, order.shopify_order_id)
+                    shopify_connection._create_common_process_log_line(log_id, order.name, order, order.shopify_order_id, f"Workflow automation failed after {retry_count} attempts.", 'error')
+            self._cr.commit()
+        return True
 
-        if sale_order.state == 'sale' and sale_order.locked != True and automation_settings.is_lock_order:
-            _logger.info("Locking sale order %s", sale_order.name)
-            sale_order.action_lock()
+    def action_retry_shopify_automation(self):
+        """
+            Put failed Shopify orders back in the automation stage.
+        """
+        self.filtered(lambda order: order.shopify_automation_id).write({
+            'shopify_automation_state': 'pending',
+            'shopify_automation_retry_count': 0,
+            'shopify_automation_next_attempt': False,
+        })
 
     def validate_delivery(self, sale_order, automation_settings):
         """
@@ -255,97 +471,123 @@ class SaleOrder(models.Model):
             Returns:
                 bool: True if the delivery process is validated.
         """
-        if automation_settings.picking_policy == "direct":
-            delivery = sale_order.picking_ids.filtered(lambda p: p.state not in ('done', 'cancel'))
-            for picking in delivery:
-                if picking.state in ('waiting', 'confirmed'):
-                    picking.action_assign()
-                if picking.move_line_ids_without_package:
-                    picking_policy = picking.picking_type_id.create_backorder = "always"
-                    picking.with_context(skip_sms=True).button_validate()
-        elif automation_settings.picking_policy == "never":
-            delivery = sale_order.picking_ids.filtered(lambda p: p.state not in ('done', 'cancel'))
-            for picking in delivery:
-                if picking.state in ('waiting', 'confirmed'):
-                    picking.action_assign()
-                if picking.move_line_ids_without_package:
-                    picking_policy = picking.picking_type_id.create_backorder = "never"
-                    picking.with_context(skip_sms=True).button_validate()
+        return self._validate_deliveries(sale_order, automation_settings)
+
+    def _validate_deliveries(self, sale_orders, automation_settings):
+        """
+            Validate the deliveries of several sale orders at once.
+            All open pickings are reserved together and validated in a single button_validate call,
+            backorders being driven by the context instead of the picking type configuration.
+            Args:
+                sale_orders (recordset): The sale orders whose deliveries are validated.
+                automation_settings (recordset): Settings that determine the picking policy.
+            Returns:
+                bool: True if the delivery process is validated.
+        """
+        pickings = sale_orders.picking_ids.filtered(lambda p: p.state not in ('done', 'cancel'))
+        if not pickings:
+            return True
+        pickings_to_assign = pickings.filtered(lambda p: p.state in ('waiting', 'confirmed'))
+        if pickings_to_assign:
+            pickings_to_assign.action_assign()
+
+        if automation_settings.picking_policy in ("direct", "never"):
+            pickings_to_validate = pickings.filtered(lambda p: p.move_line_ids_without_package)
         else:
-            delivery = sale_order.picking_ids.filtered(lambda p: p.state not in ('done', 'cancel'))
-            for picking in delivery:
-                if picking.state in ('waiting', 'confirmed'):
-                    picking.action_assign()
-                for move in picking.move_ids:
-                    move.quantity = move.product_uom_qty
-            picking.with_context(skip_backorder=True, skip_sms=True).button_validate()
+            # Shopify already shipped the whole order, so the full demand is delivered.
+            # Moves sharing a demand are written together, before the single validation below.
+            moves_by_demand = defaultdict(lambda: self.env['stock.move'])
+            for move in pickings.move_ids.filtered(lambda m: m.state not in ('done', 'cancel') and m.quantity != m.product_uom_qty):
+                moves_by_demand[move.product_uom_qty] |= move
+            for quantity, moves in moves_by_demand.items():
+                moves.write({'quantity': quantity})
+            pickings_to_validate = pickings
+
+        if not pickings_to_validate:
+            return True
+        validate_context = {'skip_backorder': True, 'skip_sms': True}
+        if automation_settings.picking_policy != "direct":
+            validate_context['picking_ids_not_to_backorder'] = pickings_to_validate.ids
+        pickings_to_validate.with_context(**validate_context).button_validate()
         return True
 
     def _register_payment(self, invoice, automation_settings):
         """
-           Register payment for an invoice.
-           :param invoice: Invoice record.
+           Register payments for invoices with a single wizard per payment journal.
+           :param invoice: Invoice records.
         """
-        for invoice in invoice:
-            self.env['account.payment.register']\
-                .with_context(active_model='account.move', active_ids=invoice.ids)\
-                .create({
-                'journal_id': automation_settings.journal_id.id,
-                'payment_method_line_id': automation_settings.inbound_payment_method_line_id.id,
-                'amount': invoice.amount_residual,
-            })._create_payments()
+        if not invoice:
+            return self.env['account.payment']
+        return self.env['account.payment.register']\
+            .with_context(active_model='account.move', active_ids=invoice.ids)\
+            .create({
+            'journal_id': automation_settings.journal_id.id,
+            'payment_method_line_id': automation_settings.inbound_payment_method_line_id.id,
+            'group_payment': False,
+        })._create_payments()
 
     def _get_product_id(self, shopify_product_id, shopify_variant_id, instance_id):
         """
             Retrieve product ID based on Shopify product ID and variant ID.
+            The variant is looked up on the (instance, Shopify variant ID) index, the product is
+            imported from Shopify when the variant is unknown.
             :param shopify_product_id: Shopify product ID.
             :param shopify_variant_id: Shopify product variant ID.
             :param instance_id: Shopify instance ID (.shopify.connector record).
             :return: Product variant record (product.product).
         """
-        product_obj = self.env['product.template']
-        connector_obj = self.env['shopify.operations.wizard']
-        product_id = product_obj.search([('shopify_product_id', '=', shopify_product_id)])
-        # return product_id
-        if product_id:
-            variant_ids = product_id.product_variant_ids
-            for variant in variant_ids:
-                if variant.shopify_variant_id == str(shopify_variant_id):
-                    return variant
-        else:
-            host = connector_obj.add_https_to_url(instance_id.shopify_host)
-            url = f"{host}/admin/api/{instance_id.version_control}/products/{shopify_product_id}.json"
-            product_id = product_obj.import_product(url, instance_id)
-            if product_id:
-                variant_ids = product_id.product_variant_ids
-                for variant in variant_ids:
-                    if variant.shopify_variant_id == str(shopify_variant_id):
-                        return variant
+        product_obj = self.env['product.product']
+        product_tmpl_obj = self.env['product.template']
+        variant_domain = [('shopify_variant_id', '=', str(shopify_variant_id)), ('shopify_instance_id', '=', instance_id.id)]
+        variant = product_obj.search(variant_domain, limit=1)
+        if not variant:
+            url = instance_id._get_shopify_api_url(f"products/{shopify_product_id}")
+            if product_tmpl_obj.import_product(url, instance_id):
+                variant = product_obj.search(variant_domain, limit=1)
+        return variant
 
     def _create_sale_order_line(self, existing_order_id, line_items, taxes_included, instance_id, log_id, order):
         """
             Create sale order lines based on Shopify order line items.
+            New product lines and their discount lines are created in a single batch, with one discount
+            line per tax combination summing the discount allocations of the new lines sharing those taxes.
+            Lines without product are skipped, and when the batch fails the lines are created one by one
+            so a single bad line does not abort the order.
             :param existing_order_id: Sale order record.
             :param line_items: List of line items from Shopify order.
-            :param tax_lines: Tax lines from Shopify order.
             :param taxes_included: Boolean indicating if taxes are included.
             :param instance_id: Shopify instance ID (shopify.connector record).
-            :return: Created sale order line record (sale.order.line).
+            :param log_id: Process log receiving the line logs.
+            :param order: Dictionary containing Shopify order data.
+            :return: Tuple of the created sale order line records (sale.order.line)
+                     and a boolean telling whether every line item was imported.
         """
         shopify_connection = self.env['shopify.connector']
         sale_order_line_obj = self.env["sale.order.line"]
         total_discount = order.get("total_discounts", 0.0)
-        existing_order_line = None
+        company = instance_id.company_id
+        create_taxes = instance_id.create_taxes
+        existing_order_lines = {
+            line.shopify_order_line_id: line for line in sale_order_line_obj.search([
+                ('shopify_order_line_id', 'in', [str(line.get('id')) for line in line_items]),
+                ('shopify_instance_id', '=', instance_id.id)])
+        }
+        new_lines = []
+        complete = True
         for line in line_items:
             name = None
+            existing_order_line = None
             try:
                 line_id = line.get('id')
                 order_qty = line.get('current_quantity')
                 name = line.get('name')
                 price = line.get('price')
-                company = instance_id.company_id
-                create_taxes = instance_id.create_taxes
                 product_id = self._get_product_id(line.get('product_id'), line.get('variant_id'), instance_id)
+                if not product_id:
+                    complete = False
+                    _logger.warning("No product found for line %s of order %s.", name, existing_order_id.name)
+                    shopify_connection._create_common_process_log_line(log_id, name, existing_order_id, line, f"Failed to created {name} order line from Shopify: product not found.", 'error')
+                    continue
                 taxes = self._get_or_create_taxes(line.get('tax_lines', []), taxes_included, company, create_taxes)
 
                 order_line_vals = {
@@ -361,21 +603,80 @@ class SaleOrder(models.Model):
                     "tax_id": [(6, 0, taxes.ids)],
                 }
 
-                existing_order_line = sale_order_line_obj.search([('shopify_order_line_id', '=', line_id), ('shopify_instance_id', '=', instance_id.id)])
+                existing_order_line = existing_order_lines.get(str(line_id))
                 if existing_order_line:
                     existing_order_line.write(order_line_vals)
                 else:
-                    existing_order_line = sale_order_line_obj.create(order_line_vals)
-                    log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_order_line, line, f"Successfully created {name} order line from Shopify.", 'success')
+                    discount_amount = 0.0
                     if float(total_discount) > 0.0:
-                        discount_amount = 0.0
-                        for discount_allocation in line.get("discount_allocations"):
-                            discount_amount += float(discount_allocation.get("amount"))
-                        self.create_discount_order_line(discount_amount, name, taxes, instance_id, existing_order_id)
+                        discount_amount = sum(float(discount_allocation.get("amount"))
+                                              for discount_allocation in line.get("discount_allocations") or [])
+                    new_lines.append((order_line_vals, line, taxes.sorted(lambda tax: tax.id), discount_amount))
 
+            except ShopifyTransientError:
+                raise
             except Exception as e:
+                complete = False
                 log_line_id = shopify_connection._create_common_process_log_line(log_id, name, existing_order_line, str(e), f"Failed to created {name} order line from Shopify.", 'error')
 
+        if not new_lines:
+            return sale_order_line_obj, complete
+        try:
+            created_lines = shopify_connection._create_unique_shopify_record(
+                'sale.order.line', [vals for vals, line, taxes, discount_amount in new_lines]
+                + self._prepare_shopify_discount_lines_values(new_lines, existing_order_id, instance_id))
+            created_new_lines = new_lines
+        except ShopifyTransientError:
+            raise
+        except Exception as e:
+            _logger.warning("Batch creation of the lines of order %s failed, creating them one by one: %s", existing_order_id.name, str(e))
+            created_lines = sale_order_line_obj
+            created_new_lines = []
+            for vals, line, taxes, discount_amount in new_lines:
+                try:
+                    created_lines |= shopify_connection._create_unique_shopify_record('sale.order.line', vals)
+                    created_new_lines.append((vals, line, taxes, discount_amount))
+                except ShopifyTransientError:
+                    raise
+                except Exception as line_error:
+                    complete = False
+                    shopify_connection._create_common_process_log_line(log_id, vals.get('name'), existing_order_id, line, f"Failed to created {vals.get('name')} order line from Shopify: {line_error}", 'error')
+            discount_vals = self._prepare_shopify_discount_lines_values(created_new_lines, existing_order_id, instance_id)
+            try:
+                if discount_vals:
+                    created_lines |= shopify_connection._create_unique_shopify_record('sale.order.line', discount_vals)
+            except ShopifyTransientError:
+                raise
+            except Exception as discount_error:
+                complete = False
+                shopify_connection._create_common_process_log_line(log_id, existing_order_id.name, existing_order_id, discount_vals, f"Failed to created discount lines of {existing_order_id.name} order: {discount_error}", 'error')
+        for order_line, (vals, line, taxes, discount_amount) in zip(created_lines, created_new_lines):
+            log_line_id = shopify_connection._create_common_process_log_line(log_id, order_line.name, order_line, line, f"Successfully created {order_line.name} order line from Shopify.", 'success')
+        return created_lines, complete
+
+    def _prepare_shopify_discount_lines_values(self, new_lines, order, instance_id):
+        """
+            Prepare one discount line per tax combination of the new product lines.
+            :param new_lines: List of (line values, Shopify line item, sorted taxes, discount amount) tuples.
+            :param order: Sale order record.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: List of discount sale order line values.
+        """
+        discount_by_taxes = defaultdict(float)
+        for vals, line, taxes, discount_amount in new_lines:
+            if discount_amount:
+                discount_by_taxes[taxes] += discount_amount
+        return [
+            self._prepare_discount_order_line_values(
+                product=instance_id.discount_product_id,
+                amount=amount,
+                taxes=taxes,
+                order=order,
+                description=_("Discount (%s)") % ", ".join(taxes.mapped('name')) if taxes else _("Discount"),
+            )
+            for taxes, amount in discount_by_taxes.items()
+        ]
+
     def _get_or_create_taxes(self, tax_lines, tax_included, company, create_taxes):
         """
             Retrieve or create taxes based on Shopify tax lines.
@@ -426,19 +727,6 @@ class SaleOrder(models.Model):
             vals['name'] = description
         return vals
 
-    def create_discount_order_line(self, product_discount, name, taxes, instance_id, existing_order_id):
-        discount_product = instance_id.discount_product_id
-        vals_list = [
-            self._prepare_discount_order_line_values(
-                product=discount_product,
-                amount=product_discount,
-                taxes=taxes,
-                order=existing_order_id,
-                description=name,
-            )
-        ]
-        discount_order_line = self.env['sale.order.line'].create(vals_list)
-
     def import_shopify_orders(self, url_status, instance_id):
         """
             Import Shopify orders within a specified date range.
@@ -456,11 +744,15 @@ class SaleOrder(models.Model):
             "X-Shopify-Access-Token": instance_id.shopify_access_token
         }
         try:
-            response = requests.get(url_status, headers=headers)
+            response = requests.get(url_status, headers=headers, params=shopify_connection._get_shopify_projection_params('orders'))
             if response.status_code == 200:
                 orders = response.json().get('orders', [])
                 order = response.json().get('order', [])
                 if order:
+                    order = shopify_connection._project_shopify_data('orders', order)
+                if order:
+                    if not self._filter_unchanged_shopify_orders([order], instance_id):
+                        return sale_order_obj.search([('shopify_order_id', '=', str(order.get('id'))), ('shopify_instance_id', '=', instance_id.id)], limit=1)
                     try:
                         order_id = sale_order_obj._create_or_update_orders(order, instance_id)
                         return order_id
@@ -488,6 +780,142 @@ class SaleOrder(models.Model):
             log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', order_id, str(e), "An error occurred while fetching orders from Shopify", 'error')
             return sale_order_obj
 
+    @api.model
+    def reconcile_shopify_orders(self, instance_id, start_date, end_date, limit=250):
+        """
+            Enqueue the Shopify orders of a date window that are missing or stale in Odoo.
+            The Shopify and Odoo counts are compared first, then the window is paged by ID with only
+            the id, updated_at and cancelled_at fields and diffed against the stored orders. Full payloads are only
+            downloaded for the orders that have to be imported again, cancelled orders and orders whose
+            last queue line is already done or cancelled are left out. The counts are only reported, the scan
+            always runs since equal counts can hide stale orders.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param start_date: Start of the window (naive UTC datetime) on the Shopify creation date.
+            :param end_date: End of the window (naive UTC datetime) on the Shopify creation date.
+            :param limit: Number of orders fetched per page.
+            :return: Dictionary summarising the reconciliation.
+        """
+        shopify_connection = self.env['shopify.connector']
+        headers = {
+            "X-Shopify-Access-Token": instance_id.shopify_access_token
+        }
+        window = {
+            'status': 'any',
+            'created_at_min': start_date.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+            'created_at_max': end_date.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+        }
+        summary = {'shopify_count': 0, 'odoo_count': 0, 'missing': 0, 'stale': 0, 'queues': self.env['shopify.queue']}
+        try:
+            response = requests.get(instance_id._get_shopify_api_url('orders/count'), headers=headers, params=window)
+            if response.status_code != 200:
+                log_id = shopify_connection._create_common_process_log("Failed to count orders in Shopify.", "sale.order", False, response.text)
+                shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to count Shopify orders. HTTP Error: {response.status_code}", 'error')
+                return summary
+            summary['shopify_count'] = response.json().get('count', 0)
+            summary['odoo_count'] = self.search_count([('shopify_instance_id', '=', instance_id.id),
+                                                       ('date_order', '>=', start_date),
+                                                       ('date_order', '<=', end_date)])
+            _logger.info("Reconciling orders of %s between %s and %s: %d in Shopify, %d in Odoo.", instance_id.name,
+                         start_date, end_date, summary['shopify_count'], summary['odoo_count'])
+            if not summary['shopify_count']:
+                return summary
+
+            order_url = instance_id._get_shopify_api_url('orders')
+            to_import = []
+            since_id = '0'
+            while True:
+                params = dict(window, fields='id,updated_at,cancelled_at', limit=limit, since_id=since_id)
+                response = requests.get(order_url, headers=headers, params=params)
+                if response.status_code != 200:
+                    log_id = shopify_connection._create_common_process_log("Failed to scan orders in Shopify.", "sale.order", False, response.text)
+                    shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to scan Shopify orders. HTTP Error: {response.status_code}", 'error')
+                    break
+                orders = response.json().get('orders', [])
+                if not orders:
+                    break
+                applied_orders = {
+                    applied['shopify_order_id']: applied['shopify_updated_at'] for applied in self.with_context(active_test=False).search_read(
+                        [('shopify_instance_id', '=', instance_id.id), ('shopify_order_id', 'in', [str(order['id']) for order in orders])],
+                        ['shopify_order_id', 'shopify_updated_at'])
+                }
+                processed_dates = self._get_processed_shopify_order_dates([str(order['id']) for order in orders], instance_id)
+                for order in orders:
+                    shopify_order_id = str(order['id'])
+                    if order.get('cancelled_at'):
+                        continue
+                    updated_at = self._convert_shopify_datetime(order.get('updated_at'))
+                    processed_date = processed_dates.get(shopify_order_id)
+                    if processed_date and (not updated_at or processed_date >= updated_at):
+                        # The current version of the order was already queued and processed
+                        continue
+                    if shopify_order_id not in applied_orders:
+                        summary['missing'] += 1
+                        to_import.append(shopify_order_id)
+                        continue
+                    applied_updated_at = applied_orders[shopify_order_id]
+                    if updated_at and (not applied_updated_at or updated_at > applied_updated_at):
+                        summary['stale'] += 1
+                        to_import.append(shopify_order_id)
+                since_id = str(max(int(order['id']) for order in orders))
+                if len(orders) < limit:
+                    break
+
+            for order_ids in split_every(limit, to_import):
+                params = dict(shopify_connection._get_shopify_projection_params('orders'),
+                              status='any', ids=','.join(order_ids), limit=limit)
+                response = requests.get(order_url, headers=headers, params=params)
+                if response.status_code != 200:
+                    log_id = shopify_connection._create_common_process_log("Failed to fetch orders from Shopify", "sale.order", False, response.text)
+                    shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to fetch sale order from Shopify. HTTP Error: {response.status_code}", 'error')
+                    continue
+                orders = response.json().get('orders', [])
+                if orders:
+                    summary['queues'] |= self.create_sale_order_data_queues(orders, instance_id)
+        except requests.RequestException as e:
+            log_id = shopify_connection._create_common_process_log("An error occurred while reconciling orders with Shopify", "sale.order", False, str(e))
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, str(e), "An error occurred while reconciling orders with Shopify", 'error')
+            return summary
+
+        if summary['missing'] or summary['stale']:
+            message = _("Reconciliation of %s to %s enqueued %d missing and %d stale orders (%d in Shopify, %d in Odoo).") % (
+                start_date, end_date, summary['missing'], summary['stale'], summary['shopify_count'], summary['odoo_count'])
+            log_id = shopify_connection._create_common_process_log(message, "sale.order", False, message)
+            shopify_connection._create_common_process_log_line(log_id, 'Reconciliation', None, message, message, 'success')
+        _logger.info("Reconciliation of %s found %d missing and %d stale orders.", instance_id.name, summary['missing'], summary['stale'])
+        return summary
+
+    @api.model
+    def _get_processed_shopify_order_dates(self, shopify_order_ids, instance_id):
+        """
+            Get the queuing date of the Shopify orders whose last queue line is done or cancelled.
+            Orders not updated on Shopify since that date are not enqueued again.
+            :param shopify_order_ids: List of Shopify order IDs.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Dictionary mapping Shopify order IDs to the creation date of their last queue line.
+        """
+        queue_lines = self.env['shopify.queue.line'].search_read(
+            [('shopify_data_id', 'in', shopify_order_ids), ('shopify_instance_id', '=', instance_id.id),
+             ('shopify_synced_queue_id.model_selection', '=', 'sale_order')],
+            ['shopify_data_id', 'state', 'create_date'], order='id desc')
+        last_lines = {}
+        for queue_line in queue_lines:
+            last_lines.setdefault(queue_line['shopify_data_id'], queue_line)
+        return {shopify_order_id: queue_line['create_date'] for shopify_order_id, queue_line in last_lines.items()
+                if queue_line['state'] in ('done', 'cancel')}
+
+    @api.model
+    def cron_reconcile_shopify_orders(self):
+        """
+            Cron job method to reconcile the orders created in the reconciliation window of each instance.
+        """
+        end_date = fields.Datetime.now()
+        for instance_id in self.env['shopify.connector'].search([('state', '=', 'integrated'),
+                                                                  ('order_reconciliation_days', '>', 0)]):
+            start_date = fields.Datetime.subtract(end_date, days=instance_id.order_reconciliation_days)
+            self.reconcile_shopify_orders(instance_id, start_date, end_date)
+            self._cr.commit()
+        return True
+
     def create_sale_order_data_queues(self, order_data, instance_id):
         """
            Create queues for sale order data import.
@@ -495,24 +923,21 @@ class SaleOrder(models.Model):
                order_data (list): List of sale order data to be queued.
                instance_id (int): ID of the Shopify instance.
            Returns:
-               list: List of created order queue IDs.
+               odoo.models.Model: Created order queues.
         """
-        order_queue_list = []
-        order_data_queue_obj = self.env["shopify.queue"]
-        order_data_queue_line_obj = self.env["shopify.queue.line"]
-
-        if len(order_data) > 0:
-            for order_id_chunk in split_every(125, order_data):
-                order_queue = order_data_queue_obj.create_queue(instance_id, "sale_order")
-                order_data_queue_line_obj.shopify_create_multi_queue(order_queue, order_id_chunk, instance_id, "sale_order")
-                order_queue_list.append(order_queue.id)
-            self._cr.commit()
-        return order_data_queue_obj.search([('id', 'in', order_queue_list)])
+        order_data = self._filter_unchanged_shopify_orders(order_data, instance_id)
+        order_data = [self.env['shopify.connector']._project_shopify_data('orders', order) for order in order_data]
+        return self.env["shopify.queue"].create_data_queues(order_data, instance_id, "sale_order")
 
 
 class SaleOrderLine(models.Model):
     _inherit = "sale.order.line"
 
-    shopify_order_line_id = fields.Char(string='Shopify Order Line ID')
+    shopify_order_line_id = fields.Char(string='Shopify Order Line ID', copy=False)
     shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', tracking=True)
 
+    _sql_constraints = [
+        ('shopify_order_line_instance_uniq', 'unique(shopify_instance_id, shopify_order_line_id)',
+         'A Shopify order line can only be imported once per instance.'),
+    ]
+
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import timedelta
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+from .shopify_queue_line import is_transient_status
+import requests
+import logging
+
+_logger = logging.getLogger(">>> Shopify Backfill <<<")
+
+# Namespace of the advisory locks held by the worker processing a window
+BACKFILL_LOCK_NAMESPACE = 7542
+# Windows are not split below this span, even when a burst of orders exceeds the target size
+BACKFILL_MIN_WINDOW = timedelta(hours=1)
+# Shopify dates have a one second precision and both date filters are inclusive, so the end of a period
+# is sent one second earlier and an order created on the boundary of two windows is fetched once
+BACKFILL_END_OFFSET = timedelta(seconds=1)
+# Attempts of a count request throttled by Shopify, waiting for the Retry-After delay in between
+BACKFILL_COUNT_ATTEMPTS = 5
+
+
+def _shopify_datetime(value):
+    """
+        Format a naive UTC datetime for the Shopify date filters.
+        :param value: Naive UTC datetime.
+        :return: ISO 8601 string.
+    """
+    return value.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class ShopifyBackfillPlan(models.Model):
+    """ Historical order import split in windows of similar order counts."""
+    _name = "shopify.backfill.plan"
+    _description = "Shopify Order Backfill Plan"
+    _order = "id desc"
+
+    name = fields.Char(string="Name", required=True, default=lambda self: _("New Backfill"))
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', required=True, ondelete="cascade")
+    start_date = fields.Datetime(string="Start Date", required=True)
+    end_date = fields.Datetime(string="End Date", required=True, default=fields.Datetime.now)
+    window_size = fields.Integer(string="Orders per Window", default=2500, required=True,
+                                 help="Target number of orders of each window, denser periods get shorter windows")
+    window_ids = fields.One2many('shopify.backfill.window', 'plan_id', string="Windows")
+    state = fields.Selection([('draft', 'Draft'), ('planned', 'Planned'), ('running', 'Running'),
+                              ('done', 'Done'), ('failed', 'Failed')], string="State",
+                             compute="_compute_state", store=True)
+    expected_count = fields.Integer(string="Expected Orders", compute="_compute_progress")
+    fetched_count = fields.Integer(string="Fetched Orders", compute="_compute_progress")
+    progress = fields.Float(string="Progress", compute="_compute_progress")
+    eta = fields.Datetime(string="Estimated End", compute="_compute_progress")
+    planning_requested = fields.Boolean(string="Planning Requested", readonly=True, copy=False,
+                                        help="The windows are planned in the background by the planning cron")
+    planning_error = fields.Text(string="Planning Error", readonly=True, copy=False)
+
+    _sql_constraints = [
+        ('window_size_positive', 'CHECK(window_size > 0)', 'The number of orders per window must be positive.'),
+        ('date_range_valid', 'CHECK(start_date < end_date)', 'The start date must be before the end date.'),
+    ]
+
+    @api.depends('window_ids.state')
+    def _compute_state(self):
+        """
+            Compute the state of the plan from the state of its windows.
+        """
+        for plan in self:
+            states = set(plan.window_ids.mapped('state'))
+            if not states:
+                plan.state = 'draft'
+            elif states == {'done'}:
+                plan.state = 'done'
+            elif 'failed' in states and not states & {'pending', 'running'}:
+                plan.state = 'failed'
+            elif states == {'pending'}:
+                plan.state = 'planned'
+            else:
+                plan.state = 'running'
+
+    @api.depends('window_ids.expected_count', 'window_ids.fetched_count', 'window_ids.eta')
+    def _compute_progress(self):
+        """
+            Compute the progress of the plan and its end estimate from the windows.
+        """
+        for plan in self:
+            plan.expected_count = sum(plan.window_ids.mapped('expected_count'))
+            plan.fetched_count = sum(plan.window_ids.mapped('fetched_count'))
+            plan.progress = plan.expected_count and min(100.0, 100.0 * plan.fetched_count / plan.expected_count)
+            etas = [eta for eta in plan.window_ids.mapped('eta') if eta]
+            plan.eta = max(etas) if etas else False
+
+    def _count_shopify_orders(self, start_date, end_date):
+        """
+            Count the Shopify orders created in a period with the count endpoint.
+            Throttled and server errors are retried after the Retry-After delay sent by Shopify.
+            :param start_date: Start of the period (naive UTC datetime), included.
+            :param end_date: End of the period (naive UTC datetime), excluded.
+            :return: Number of orders.
+        """
+        self.ensure_one()
+        instance_id = self.shopify_instance_id
+        for attempt in range(BACKFILL_COUNT_ATTEMPTS):
+            response = requests.get(instance_id._get_shopify_api_url('orders/count'),
+                                    headers={"X-Shopify-Access-Token": instance_id.shopify_access_token},
+                                    params={'status': 'any', 'created_at_min': _shopify_datetime(start_date),
+                                            'created_at_max': _shopify_datetime(end_date - BACKFILL_END_OFFSET)})
+            if not is_transient_status(response.status_code) or attempt == BACKFILL_COUNT_ATTEMPTS - 1:
+                break
+            try:
+                delay = float(response.headers.get('Retry-After') or 2.0)
+            except ValueError:
+                delay = 2.0
+            _logger.info("Shopify order count throttled (HTTP %s), retrying in %.1f seconds.", response.status_code, delay)
+            time.sleep(min(delay, 30.0))
+        if response.status_code != 200:
+            raise ValidationError(_("Failed to count Shopify orders. HTTP Error: %s") % response.status_code)
+        return response.json().get('count', 0)
+
+    def _split_period(self, start_date, end_date, count):
+        """
+            Split a period in halves until each part holds at most the window size.
+            :param start_date: Start of the period (naive UTC datetime).
+            :param end_date: End of the period (naive UTC datetime).
+            :param count: Number of orders of the period.
+            :return: List of (start, end, count) windows.
+        """
+        if count <= self.window_size or end_date - start_date <= BACKFILL_MIN_WINDOW:
+            return [(start_date, end_date, count)] if count else []
+        middle_date = start_date + (end_date - start_date) / 2
+        first_count = self._count_shopify_orders(start_date, middle_date)
+        return (self._split_period(start_date, middle_date, first_count)
+                + self._split_period(middle_date, end_date, max(count - first_count, 0)))
+
+    def action_plan_backfill(self):
+        """
+            Request the planning of the windows, done in the background by the planning cron
+            since a long date range takes many count requests.
+        """
+        for plan in self:
+            if plan.window_ids.filtered(lambda window: window.state != 'pending'):
+                raise ValidationError(_("The backfill %s has already started and cannot be planned again.") % plan.name)
+        self.write({'planning_requested': True, 'planning_error': False})
+        return True
+
+    def _plan_windows(self):
+        """
+            Split the date range of the plan in windows sized by order density.
+            Each split costs one count request, so a multi-year range is planned in a few dozen calls.
+        """
+        for plan in self:
+            plan.window_ids.unlink()
+            total_count = plan._count_shopify_orders(plan.start_date, plan.end_date)
+            windows = plan._split_period(plan.start_date, plan.end_date, total_count)
+            self.env['shopify.backfill.window'].create([{
+                'plan_id': plan.id,
+                'start_date': start_date,
+                'end_date': end_date,
+                'expected_count': count,
+            } for start_date, end_date, count in windows])
+            _logger.info("Planned backfill %s: %d orders in %d windows.", plan.name, total_count, len(windows))
+        return True
+
+    @api.model
+    def cron_plan_backfills(self):
+        """
+            Cron job method planning the windows of the backfills requested from the form.
+            A failed planning is reported on the plan and can be requested again.
+        """
+        for plan in self.search([('planning_requested', '=', True)]):
+            try:
+                plan._plan_windows()
+                plan.planning_requested = False
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error("Failed to plan backfill %s: %s", plan.name, str(e), exc_info=True)
+                plan.write({'planning_requested': False, 'planning_error': str(e)})
+            self.env.cr.commit()
+        return True
+
+    def action_retry_failed_windows(self):
+        """
+            Put the failed windows back in the pending state, they resume from their last fetched order.
+        """
+        self.window_ids.filtered(lambda window: window.state == 'failed').write({'state': 'pending', 'last_error': False})
+        return True
+
+
+class ShopifyBackfillWindow(models.Model):
+    """ Resumable part of a backfill plan, fetched by one worker at a time."""
+    _name = "shopify.backfill.window"
+    _description = "Shopify Order Backfill Window"
+    _order = "start_date, id"
+
+    plan_id = fields.Many2one('shopify.backfill.plan', string="Backfill", required=True, ondelete="cascade", index=True)
+    shopify_instance_id = fields.Many2one(related="plan_id.shopify_instance_id", store=True)
+    start_date = fields.Datetime(string="Start Date", required=True)
+    end_date = fields.Datetime(string="End Date", required=True)
+    expected_count = fields.Integer(string="Expected Orders", readonly=True)
+    fetched_count = fields.Integer(string="Fetched Orders", readonly=True)
+    since_id = fields.Char(string="Last Fetched Order ID", readonly=True, copy=False,
+                           help="Resume point of the window, pages are fetched by increasing order ID")
+    state = fields.Selection([('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                             string="State", default='pending', required=True, index=True)
+    started_at = fields.Datetime(string="Started On", readonly=True, copy=False)
+    last_progress_at = fields.Datetime(string="Last Progress On", readonly=True, copy=False)
+    last_error = fields.Text(string="Last Error", readonly=True, copy=False)
+    progress = fields.Float(string="Progress", compute="_compute_eta")
+    eta = fields.Datetime(string="Estimated End", compute="_compute_eta")
+
+    @api.depends('expected_count', 'fetched_count', 'started_at', 'last_progress_at', 'state')
+    def _compute_eta(self):
+        """
+            Compute the progress of the window and extrapolate its end from the fetch rate so far.
+        """
+        for window in self:
+            window.progress = 100.0 if window.state == 'done' else (
+                window.expected_count and min(100.0, 100.0 * window.fetched_count / window.expected_count))
+            window.eta = False
+            if window.state == 'running' and window.fetched_count and window.last_progress_at and window.started_at:
+                elapsed = window.last_progress_at - window.started_at
+                remaining = max(window.expected_count - window.fetched_count, 0)
+                window.eta = window.last_progress_at + elapsed * remaining / window.fetched_count
+
+    @api.model
+    def _claim_window(self):
+        """
+            Take the next window no other worker is processing.
+            The advisory lock is held by the database session, so it survives the commits made after each page.
+            :return: Claimed shopify.backfill.window record, empty when every window is taken.
+        """
+        for window in self.search([('state', 'in', ['pending', 'running'])]):
+            self.env.cr.execute("SELECT pg_try_advisory_lock(%s, %s)", [BACKFILL_LOCK_NAMESPACE, window.id])
+            if self.env.cr.fetchone()[0]:
+                return window
+        return self.browse()
+
+    def _release_window(self):
+        """
+            Release the advisory lock taken by _claim_window.
+        """
+        self.env.cr.execute("SELECT pg_advisory_unlock(%s, %s)", [BACKFILL_LOCK_NAMESPACE, self.id])
+
+    def _fetch_window(self, deadline, limit=250):
+        """
+            Fetch the orders of the window page by page into import queues, committing after each page.
+            :param deadline: time.monotonic() value after which the window is left for the next run.
+            :param limit: Number of orders fetched per page.
+            :return: True when the window is complete, False when it failed or was interrupted.
+        """
+        self.ensure_one()
+        instance_id = self.shopify_instance_id
+        shopify_connection = self.env['shopify.connector']
+        headers = {
+            "X-Shopify-Access-Token": instance_id.shopify_access_token
+        }
+        url = instance_id._get_shopify_api_url('orders')
+        if self.state == 'pending':
+            self.write({'state': 'running', 'started_at': self.started_at or fields.Datetime.now()})
+            self.env.cr.commit()
+        while time.monotonic() < deadline:
+            params = dict(shopify_connection._get_shopify_projection_params('orders'), status='any', limit=limit,
+                          since_id=self.since_id or '0', created_at_min=_shopify_datetime(self.start_date),
+                          created_at_max=_shopify_datetime(self.end_date - BACKFILL_END_OFFSET))
+            try:
+                response = requests.get(url, headers=headers, params=params)
+            except requests.RequestException as e:
+                _logger.warning("Backfill window %s interrupted, it will resume on the next run: %s", self.id, str(e))
+                return False
+            if response.status_code != 200:
+                if is_transient_status(response.status_code):
+                    _logger.warning("Backfill window %s throttled (HTTP %s), it will resume on the next run.", self.id, response.status_code)
+                    return False
+                self.write({'state': 'failed', 'last_error': f"HTTP Error: {response.status_code} {response.text}"})
+                self.env.cr.commit()
+                return False
+            orders = response.json().get('orders', [])
+            if orders:
+                self.env['sale.order'].create_sale_order_data_queues(orders, instance_id)
+                self.write({
+                    'since_id': str(max(int(order.get('id')) for order in orders)),
+                    'fetched_count': self.fetched_count + len(orders),
+                    'last_progress_at': fields.Datetime.now(),
+                })
+            if len(orders) < limit:
+                self.write({'state': 'done', 'last_progress_at': fields.Datetime.now()})
+                self.env.cr.commit()
+                return True
+            self.env.cr.commit()
+        return False
+
+    @api.model
+    def cron_process_backfill_windows(self, time_limit=240):
+        """
+            Cron job method fetching backfill windows until the time limit.
+            Windows are locked per worker, so several copies of this cron process different windows in parallel
+            and an interrupted window resumes from its last fetched order.
+            :param time_limit: Seconds after which the worker stops taking pages.
+        """
+        deadline = time.monotonic() + time_limit
+        while time.monotonic() < deadline:
+            window = self._claim_window()
+            if not window:
+                break
+            try:
+                window._fetch_window(deadline)
+            finally:
+                window._release_window()
+            if window.state == 'running':
+                # Out of time or throttled by Shopify, the window resumes on the next run
+                break
+            self.env.invalidate_all()
+        return True
@@ -1,11 +1,43 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import Command, models, fields, api, _
+from psycopg2.errors import UniqueViolation
+from odoo.exceptions import ValidationError
+from .shopify_queue_line import ShopifyTransientError, is_transient_status
 import requests
+import json
 import logging
 
 _logger = logging.getLogger(">>> Common Process Logs <<<")
 
+# Fields of each Shopify resource read by the import code, nested objects map to the sub-fields kept
+SHOPIFY_FIELD_PROJECTIONS = {
+    'orders': {
+        'id': None,
+        'name': None,
+        'created_at': None,
+        'updated_at': None,
+        'cancelled_at': None,
+        'financial_status': None,
+        'fulfillment_status': None,
+        'payment_gateway_names': None,
+        'customer': ('id',),
+        'tax_lines': ('title', 'rate', 'price'),
+        'taxes_included': None,
+        'total_discounts': None,
+        'line_items': ('id', 'name', 'price', 'current_quantity', 'product_id', 'variant_id',
+                       'tax_lines', 'discount_allocations'),
+    },
+    'customers': {
+        'id': None,
+        'first_name': None,
+        'last_name': None,
+        'email': None,
+        'phone': None,
+        'default_address': ('address1', 'address2', 'city', 'zip', 'province', 'country_code'),
+    },
+}
+
 
 class ShopifyConnector(models.Model):
     _name = 'shopify.connector'
@@ -82,11 +114,37 @@ class ShopifyConnector(models.Model):
     shopify_webhook_ids = fields.One2many("shopify.webhook", "shopify_instance_id", string="Shopify Webhooks", tracking=True, required=True)
     shopify_sale_order_process_ids = fields.One2many('shopify.sale.order.process.configuration', 'multi_shopify_connector_id', string="Order Process Configuration", tracking=True)
     location_id = fields.Many2one('stock.location', string='Location', default=_get_set_default_location_id, required=True)
+    shopify_location_ids = fields.One2many('shopify.location', 'shopify_instance_id', string="Shopify Locations",
+                                           help="Odoo warehouses and locations whose stock is exported to each Shopify location")
     discount_product_id = fields.Many2one("product.product", "Discount",
                                           domain=[('detailed_type', '=', 'service')],
                                           default=_default_discount_product, store=True, required=True,
                                           help="This is used for set discount product in a sale order lines")
     create_taxes = fields.Boolean("Create new tax If Not Found")
+    queue_chunk_size = fields.Integer(string="Queue Chunk Size", default=125,
+                                      help="Number of Shopify records stored in each import queue")
+    queue_concurrency_limit = fields.Integer(string="Concurrent Queue Workers", default=1,
+                                             help="Maximum number of queues of this instance processed at the same time by the queue workers (up to 3)")
+    shopify_product_export_watermark = fields.Datetime(string="Product Export Watermark", readonly=True, copy=False,
+                                                       help="Start of the last successful export of product prices to Shopify")
+    shopify_fulfillment_watermark = fields.Datetime(string="Fulfillment Export Watermark", readonly=True, copy=False,
+                                                    help="Validation date of the last delivery exported to Shopify")
+    shopify_statistics_id = fields.Many2one('shopify.instance.statistics', string="Statistics", readonly=True, copy=False)
+    backlog_order_count = fields.Integer(related="shopify_statistics_id.backlog_order_count")
+    backlog_customer_count = fields.Integer(related="shopify_statistics_id.backlog_customer_count")
+    backlog_product_count = fields.Integer(related="shopify_statistics_id.backlog_product_count")
+    orders_last_hour = fields.Integer(related="shopify_statistics_id.orders_last_hour")
+    error_rate = fields.Float(related="shopify_statistics_id.error_rate")
+    average_latency = fields.Float(related="shopify_statistics_id.average_latency")
+    last_success_date = fields.Datetime(related="shopify_statistics_id.last_success_date")
+    order_reconciliation_days = fields.Integer(string="Order Reconciliation Window (Days)", default=30,
+                                               help="Orders created in this many past days are checked daily for missing or stale imports, 0 disables the check")
+    shopify_gateway_since_id = fields.Char(string="Payment Gateway Watermark", readonly=True, copy=False,
+                                           help="ID of the last Shopify order scanned for payment gateways")
+
+    _sql_constraints = [
+        ('queue_chunk_size_positive', 'CHECK(queue_chunk_size > 0)', 'The queue chunk size must be positive.'),
+    ]
 
     @api.onchange('company_id')
     def _onchange_company_id(self):
@@ -110,6 +168,102 @@ class ShopifyConnector(models.Model):
             shop_url = "https://" + shop[0] + "/admin/api/" + self.version_control + "/shop.json"
         return shop_url
 
+    def action_reconcile_shopify_webhooks(self):
+        """
+           Synchronize the webhook subscriptions of the instance with its webhook configuration.
+        """
+        webhook_obj = self.env['shopify.webhook']
+        summary = {'created': 0, 'updated': 0, 'deleted': 0}
+        for instance in self:
+            for key, count in webhook_obj.reconcile_shopify_webhooks(instance).items():
+                summary[key] += count
+        return self._create_notification('Success', 'Webhooks synchronized: %(created)s created, %(updated)s updated, %(deleted)s deleted.' % summary, 'success')
+
+    def action_rebuild_shopify_statistics(self):
+        """
+           Rebuild the dashboard backlog counters of the instance from its queue lines.
+        """
+        statistics = self.env['shopify.instance.statistics']
+        for instance in self:
+            statistics._get_instance_statistics(instance).action_rebuild_statistics()
+        return self._create_notification('Success', 'Shopify statistics rebuilt.', 'success')
+
+    @api.model
+    def _get_shopify_projection_params(self, resource):
+        """
+           Get the query parameters restricting a Shopify fetch to the fields read by the import.
+           :param resource: Shopify resource, key of SHOPIFY_FIELD_PROJECTIONS.
+           :return: Dictionary of query parameters.
+        """
+        return {'fields': ','.join(SHOPIFY_FIELD_PROJECTIONS[resource])}
+
+    @api.model
+    def _project_shopify_data(self, resource, data):
+        """
+           Keep only the fields read by the import in a Shopify payload.
+           Shopify only projects top-level fields, nested objects are trimmed here before storage.
+           :param resource: Shopify resource, key of SHOPIFY_FIELD_PROJECTIONS.
+           :param data: Dictionary containing Shopify data.
+           :return: Projected dictionary.
+        """
+        projected = {}
+        for key, sub_fields in SHOPIFY_FIELD_PROJECTIONS[resource].items():
+            if key not in data:
+                continue
+            value = data[key]
+            if sub_fields and isinstance(value, dict):
+                value = {sub_key: value[sub_key] for sub_key in sub_fields if sub_key in value}
+            elif sub_fields and isinstance(value, list):
+                value = [{sub_key: item[sub_key] for sub_key in sub_fields if sub_key in item}
+                         if isinstance(item, dict) else item for item in value]
+            projected[key] = value
+        return projected
+
+    def _get_shopify_api_url(self, resource):
+        """
+           Build the Shopify Admin API URL of a resource for this store.
+           :param resource: Resource path without extension, e.g. 'orders' or 'orders/count'.
+           :return: Shopify API URL.
+        """
+        self.ensure_one()
+        shop = self.shopify_host.split("//")
+        if len(shop) == 2:
+            host = shop[0] + "//" + shop[1]
+        else:
+            host = "https://" + shop[0]
+        return host + "/admin/api/" + self.version_control + "/" + resource + ".json"
+
+    def _shopify_graphql(self, query, variables=None):
+        """
+           Run a query or a mutation on the Shopify Admin GraphQL API.
+           :param query: GraphQL document.
+           :param variables: Dictionary of GraphQL variables.
+           :return: The 'data' part of the response.
+           :raises: ShopifyTransientError on network errors, throttling and server errors,
+                    ValidationError when Shopify rejects the document.
+        """
+        self.ensure_one()
+        headers = {
+            'X-Shopify-Access-Token': self.shopify_access_token,
+            'Content-Type': 'application/json'
+        }
+        try:
+            response = requests.post(self._get_shopify_api_url('graphql'), headers=headers,
+                                     data=json.dumps({'query': query, 'variables': variables or {}}))
+        except requests.RequestException as e:
+            raise ShopifyTransientError(str(e))
+        if is_transient_status(response.status_code):
+            raise ShopifyTransientError(f"Shopify GraphQL API HTTP Error: {response.status_code}")
+        if response.status_code != 200:
+            raise ValidationError(_("Shopify GraphQL API HTTP Error: %s %s", response.status_code, response.text))
+        result = response.json()
+        errors = result.get('errors')
+        if errors:
+            if any((error.get('extensions') or {}).get('code') == 'THROTTLED' for error in errors):
+                raise ShopifyTransientError("Shopify GraphQL API throttled the request.")
+            raise ValidationError(_("Shopify GraphQL API Error: %s", errors))
+        return result.get('data') or {}
+
     def reset_to_draft_connection(self):
         """
            Reset the connection state to draft.
@@ -155,7 +309,6 @@ class ShopifyConnector(models.Model):
            Perform action to establish connection with Shopify.
            :return: Notification message for UI indicating success or failure of connection.
         """
-        connector_obj = self.env['shopify.operations.wizard']
         payment_gateway = self.env["shopify.payment.gateway"]
         self.ensure_one()
         url = self.truncate_shopify_store_url(self.shopify_host)
@@ -172,13 +325,16 @@ class ShopifyConnector(models.Model):
                 # Update location's shopify_location_id field
                 if self.location_id:
                     self.location_id.shopify_location_id = location
+                self.env['shopify.location'].import_shopify_locations(self)
 
-                self.write({'shopify_store_time_zone': shop_data.get('timezone')})
+                vals = {'shopify_store_time_zone': shop_data.get('timezone')}
+                if not self.shopify_product_export_watermark:
+                    # Only the products changed after the connection are exported
+                    vals['shopify_product_export_watermark'] = fields.Datetime.now()
+                self.write(vals)
                 self.sync_shopify_currency(shop_data.get('currency'))
 
-                payment_status = connector_obj.truncate_shopify_store_url(self.shopify_host, self, 'orders')
-                patment_urlstatus = f"{payment_status}?status=any&fields=payment_gateway_names&limit=250"
-                payment_gateway.create_shopify_payment_gateway(patment_urlstatus, self)
+                payment_gateway.create_shopify_payment_gateway(self)
 
                 return self._create_notification('Success', 'Store %s is successfully connected to Shopify!' % self.name,
                                                  'success')
@@ -192,6 +348,12 @@ class ShopifyConnector(models.Model):
             self.state = 'error'
             return self._create_notification('Connection Error',
                                              f'An error occurred while connecting to Shopify: {str(e)}', 'danger')
+        except ShopifyTransientError as e:
+            _logger.warning("Shopify connection of %s interrupted: %s", self.name, str(e))
+            log_id = self._create_common_process_log("An error occurred while connecting to Shopify.", "shopify.connector", self, str(e))
+            self._create_common_process_log_line(log_id, 'Error', self, str(e), "An error occurred while connecting to Shopify.", 'error')
+            return self._create_notification('Connection Error',
+                                             f'A temporary error occurred while connecting to Shopify, please try again: {str(e)}', 'warning')
 
     @api.model
     def create(self, vals):
@@ -204,7 +366,56 @@ class ShopifyConnector(models.Model):
             vals['warehouse_id'] = self._get_set_default_warehouse()
         if vals.get("shopify_host").endswith('/'):
             vals["shopify_host"] = vals.get("shopify_host").rstrip('/')
-        return super(ShopifyConnector, self).create(vals)
+        instance = super(ShopifyConnector, self).create(vals)
+        # Created with the instance, so the queue workers only ever update existing statistics
+        instance.shopify_statistics_id = self.env['shopify.instance.statistics'].sudo().create({'shopify_instance_id': instance.id})
+        return instance
+
+    def _get_changed_vals(self, record, vals):
+        """
+            Keep only the values that differ from what is stored on a record.
+            Values are normalized with the field cache conversion before being compared,
+            x2many commands are kept unless they set exactly the current records.
+            Args:
+                record (recordset): The record about to be written.
+                vals (dict): The values to write.
+            Returns:
+                dict: The values that actually change the record.
+        """
+        record.ensure_one()
+        changed_vals = {}
+        for name, value in vals.items():
+            field = record._fields[name]
+            if field.type in ('one2many', 'many2many'):
+                if len(value) == 1 and value[0][0] == Command.SET and set(value[0][2]) == set(record[name].ids):
+                    continue
+                changed_vals[name] = value
+                continue
+            try:
+                if field.convert_to_cache(value, record) == field.convert_to_cache(record[name], record):
+                    continue
+            except (ValueError, TypeError):
+                pass
+            changed_vals[name] = value
+        return changed_vals
+
+    def _create_unique_shopify_record(self, model, vals):
+        """
+            Create a record protected by a unique (instance, Shopify ID) index.
+            The insert runs in a savepoint, when a parallel worker created the same Shopify record
+            first the conflict is reported as a transient error so the queue line is retried and
+            then finds the committed record instead of creating a duplicate.
+            Args:
+                model (str): Name of the model to create the record in.
+                vals (dict or list): Values of the new record(s).
+            Returns:
+                recordset: The created record(s).
+        """
+        try:
+            with self.env.cr.savepoint():
+                return self.env[model].create(vals)
+        except UniqueViolation as e:
+            raise ShopifyTransientError(f"{model} record was created concurrently by another worker: {e}")
 
     def _create_common_process_log(self, message, model=False, res_id=False, response=False):
         """
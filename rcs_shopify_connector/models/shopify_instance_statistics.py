@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from odoo import models, fields, api, _
+import logging
+
+_logger = logging.getLogger(">>> Shopify Statistics <<<")
+
+# Backlog counter of each queue model
+BACKLOG_FIELDS = {
+    'sale_order': 'backlog_order_count',
+    'res_partner': 'backlog_customer_count',
+    'product': 'backlog_product_count',
+}
+
+
+class ShopifyInstanceStatistics(models.Model):
+    """ Counters of a Shopify instance maintained incrementally by the queues, read by the dashboard."""
+    _name = "shopify.instance.statistics"
+    _description = "Shopify Instance Statistics"
+    _rec_name = "shopify_instance_id"
+
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', required=True, ondelete="cascade")
+    backlog_order_count = fields.Integer(string="Order Backlog", readonly=True)
+    backlog_customer_count = fields.Integer(string="Customer Backlog", readonly=True)
+    backlog_product_count = fields.Integer(string="Product Backlog", readonly=True)
+    processed_count = fields.Integer(string="Processed Records", readonly=True)
+    error_count = fields.Integer(string="Failed Records", readonly=True)
+    total_latency = fields.Float(string="Total Latency (s)", readonly=True,
+                                 help="Sum of the delays between queuing and processing of the processed records")
+    order_hour = fields.Datetime(string="Last Order Hour", readonly=True, help="Hour of the last processing run importing orders")
+    orders_current_hour = fields.Integer(string="Orders of the Last Order Hour", readonly=True)
+    orders_previous_hour = fields.Integer(string="Orders of the Hour Before", readonly=True)
+    orders_last_hour = fields.Integer(string="Orders Last Hour", compute="_compute_orders_last_hour")
+    last_success_date = fields.Datetime(string="Last Successful Sync", readonly=True)
+    error_rate = fields.Float(string="Error Rate (%)", compute="_compute_rates")
+    average_latency = fields.Float(string="Average Latency (s)", compute="_compute_rates")
+
+    _sql_constraints = [
+        ('shopify_instance_uniq', 'unique(shopify_instance_id)', 'Statistics already exist for this Shopify instance.'),
+    ]
+
+    @api.depends('processed_count', 'error_count', 'total_latency')
+    def _compute_rates(self):
+        """
+            Compute the error rate and the average latency from the stored counters.
+        """
+        for statistics in self:
+            statistics.error_rate = statistics.processed_count and 100.0 * statistics.error_count / statistics.processed_count
+            statistics.average_latency = statistics.processed_count and statistics.total_latency / statistics.processed_count
+
+    @api.depends('order_hour', 'orders_current_hour', 'orders_previous_hour')
+    def _compute_orders_last_hour(self):
+        """
+            Compute the orders of the hour before the current one from the hourly buckets.
+            The buckets only roll over when orders are processed, so they are read against the current hour.
+        """
+        hour = fields.Datetime.now().replace(minute=0, second=0, microsecond=0)
+        for statistics in self:
+            if statistics.order_hour == hour:
+                statistics.orders_last_hour = statistics.orders_previous_hour
+            elif statistics.order_hour == hour - timedelta(hours=1):
+                statistics.orders_last_hour = statistics.orders_current_hour
+            else:
+                statistics.orders_last_hour = 0
+
+    @api.model
+    def _get_instance_statistics(self, instance):
+        """
+            Get the statistics of an instance, they are created with the instance.
+            Statistics missing on an older instance are inserted with ON CONFLICT DO NOTHING,
+            so concurrent queue workers never try to create them twice.
+            :param instance: Shopify instance ID (shopify.connector record).
+            :return: shopify.instance.statistics record.
+        """
+        statistics = instance.shopify_statistics_id
+        if statistics:
+            return statistics
+        self.env.cr.execute("""
+            INSERT INTO shopify_instance_statistics (shopify_instance_id, create_uid, create_date, write_uid, write_date)
+            VALUES (%(instance)s, %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+            ON CONFLICT (shopify_instance_id) DO NOTHING
+            RETURNING id
+        """, {'instance': instance.id, 'uid': self.env.uid})
+        row = self.env.cr.fetchone()
+        if row:
+            statistics = self.browse(row[0])
+            instance.sudo().shopify_statistics_id = statistics
+            return statistics
+        return self.sudo().search([('shopify_instance_id', '=', instance.id)], limit=1)
+
+    def _increment(self, **deltas):
+        """
+            Add values to the counters in one UPDATE so concurrent queue workers never overwrite each other.
+            :param deltas: Counter field names mapped to the value added.
+        """
+        self.ensure_one()
+        assignments = ", ".join(f"{name} = COALESCE({name}, 0) + %({name})s" for name in deltas)
+        self.env.cr.execute(f"UPDATE shopify_instance_statistics SET {assignments} WHERE id = %(id)s",
+                            dict(deltas, id=self.id))
+        self.invalidate_recordset(list(deltas))
+
+    @api.model
+    def _record_enqueued(self, instance, model_selection, count):
+        """
+            Add newly queued records to the backlog of an instance.
+            :param instance: Shopify instance ID (shopify.connector record).
+            :param model_selection: Type of data model ('res_partner', 'sale_order', 'product').
+            :param count: Number of queued records.
+        """
+        if instance and count:
+            self._get_instance_statistics(instance)._increment(**{BACKLOG_FIELDS[model_selection]: count})
+
+    @api.model
+    def _record_removed(self, instance, model_selection, count):
+        """
+            Remove deleted draft records from the backlog of an instance.
+            :param instance: Shopify instance ID (shopify.connector record).
+            :param model_selection: Type of data model ('res_partner', 'sale_order', 'product').
+            :param count: Number of deleted records.
+        """
+        if instance and count and model_selection in BACKLOG_FIELDS:
+            self._get_instance_statistics(instance)._increment(**{BACKLOG_FIELDS[model_selection]: -count})
+
+    @api.model
+    def _record_processing_run(self, queue, queue_lines, processed_date):
+        """
+            Update the counters of an instance after a processing run of one of its queues.
+            Lines left in draft are waiting for a retry and stay in the backlog.
+            :param queue: Processed shopify.queue record.
+            :param queue_lines: Lines handled during the run.
+            :param processed_date: Date of the run.
+        """
+        if not queue.shopify_instance_id:
+            return
+        finished_lines = queue_lines.filtered(lambda line: line.state in ('done', 'cancel'))
+        if not finished_lines:
+            return
+        done_count = len(finished_lines.filtered(lambda line: line.state == 'done'))
+        statistics = self._get_instance_statistics(queue.shopify_instance_id)
+        statistics._increment(**{
+            BACKLOG_FIELDS[queue.model_selection]: -len(finished_lines),
+            'processed_count': len(finished_lines),
+            'error_count': len(finished_lines) - done_count,
+            'total_latency': sum((processed_date - line.create_date).total_seconds() for line in finished_lines),
+        })
+        if done_count:
+            hour = processed_date.replace(minute=0, second=0, microsecond=0)
+            orders = done_count if queue.model_selection == 'sale_order' else 0
+            # All SET expressions read the old row, so the hourly buckets roll over atomically
+            self.env.cr.execute("""
+                UPDATE shopify_instance_statistics
+                   SET orders_previous_hour = CASE WHEN order_hour = %(hour)s THEN orders_previous_hour
+                                                   WHEN order_hour = %(hour)s - interval '1 hour' THEN orders_current_hour
+                                                   ELSE 0 END,
+                       orders_current_hour = CASE WHEN order_hour = %(hour)s THEN orders_current_hour ELSE 0 END + %(orders)s,
+                       order_hour = %(hour)s,
+                       last_success_date = GREATEST(last_success_date, %(date)s)
+                 WHERE id = %(id)s
+            """, {'hour': hour, 'orders': orders, 'date': processed_date, 'id': statistics.id})
+            statistics.invalidate_recordset(['orders_previous_hour', 'orders_current_hour', 'order_hour', 'last_success_date'])
+
+    def action_rebuild_statistics(self):
+        """
+            Recompute the backlog counters from the queue lines, to recover from any drift.
+            This scans the queue lines of the instance and is only run on demand.
+        """
+        for statistics in self:
+            groups = self.env['shopify.queue.line']._read_group(
+                [('shopify_instance_id', '=', statistics.shopify_instance_id.id), ('state', '=', 'draft')],
+                groupby=['shopify_synced_queue_id'], aggregates=['__count'])
+            backlog = dict.fromkeys(BACKLOG_FIELDS.values(), 0)
+            for queue, count in groups:
+                if queue.model_selection in BACKLOG_FIELDS:
+                    backlog[BACKLOG_FIELDS[queue.model_selection]] += count
+            statistics.write(backlog)
+            _logger.info("Rebuilt the backlog statistics of %s: %s", statistics.shopify_instance_id.name, backlog)
+        return True
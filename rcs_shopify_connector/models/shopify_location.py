@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import requests
+import logging
+
+_logger = logging.getLogger(">>> Shopify Location <<<")
+
+
+class ShopifyLocation(models.Model):
+    _name = "shopify.location"
+    _description = "Shopify Location"
+    _rec_name = "name"
+
+    name = fields.Char(string="Name", required=True)
+    shopify_location_id = fields.Char(string="Shopify Location ID", required=True)
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', required=True, ondelete="cascade")
+    warehouse_ids = fields.Many2many('stock.warehouse', string="Warehouses",
+                                     help="Stock of these warehouses is published to the Shopify location")
+    location_ids = fields.Many2many('stock.location', string="Locations", domain=[('usage', '=', 'internal')],
+                                    help="Stock of these locations and their child locations is published to the Shopify location")
+    active = fields.Boolean(string="Active", default=True)
+
+    _sql_constraints = [
+        ('shopify_location_instance_uniq', 'unique(shopify_instance_id, shopify_location_id)',
+         'A Shopify location can only be mapped once per instance.'),
+    ]
+
+    def _get_stock_locations(self):
+        """
+            Get the Odoo locations mapped to the Shopify location, warehouses are mapped through their stock location.
+            :return: stock.location records.
+        """
+        self.ensure_one()
+        return self.location_ids | self.warehouse_ids.lot_stock_id
+
+    @api.model
+    def import_shopify_locations(self, instance_id):
+        """
+            Create the Shopify locations of an instance that are not mapped yet.
+            The primary location of the store is mapped to the location of the instance.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Newly created shopify.location records.
+        """
+        shopify_connection = self.env['shopify.connector']
+        headers = {
+            "X-Shopify-Access-Token": instance_id.shopify_access_token
+        }
+        try:
+            response = requests.get(instance_id._get_shopify_api_url('locations'), headers=headers)
+        except requests.RequestException as e:
+            log_id = shopify_connection._create_common_process_log("An error occurred while fetching locations from Shopify.", "shopify.location", False, str(e))
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, str(e), "An error occurred while fetching locations from Shopify.", 'error')
+            return self
+        if response.status_code != 200:
+            log_id = shopify_connection._create_common_process_log("Failed to fetch locations from Shopify.", "shopify.location", False, response.text)
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to fetch locations. HTTP Error: {response.status_code}", 'error')
+            return self
+        existing_location_ids = set(self.with_context(active_test=False).search(
+            [('shopify_instance_id', '=', instance_id.id)]).mapped('shopify_location_id'))
+        primary_location_id = instance_id.location_id.shopify_location_id
+        new_location_vals = []
+        for location in response.json().get('locations', []):
+            shopify_location_id = str(location.get('id'))
+            if shopify_location_id in existing_location_ids:
+                continue
+            vals = {
+                'name': location.get('name'),
+                'shopify_location_id': shopify_location_id,
+                'shopify_instance_id': instance_id.id,
+                'active': location.get('active', True),
+            }
+            if shopify_location_id == primary_location_id and instance_id.location_id:
+                vals['location_ids'] = [(6, 0, instance_id.location_id.ids)]
+            new_location_vals.append(vals)
+        return self.create(new_location_vals)
+
+    @api.model
+    def _get_shopify_stock_quantities(self, products, instance_id):
+        """
+            Compute the quantity of every product for every mapped Shopify location of an instance.
+            All quantities come from a single grouped query on stock.quant over the mapped locations
+            and their child locations, each quant location is then attributed to its closest mapped ancestor.
+            The Shopify locations are imported on first use, and the location of the instance is used
+            for its Shopify location when nothing is mapped.
+            :param products: product.product records.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Dictionary mapping (product ID, Shopify location ID) to the available quantity.
+        """
+        shopify_locations = self.search([('shopify_instance_id', '=', instance_id.id)])
+        if not shopify_locations:
+            self.import_shopify_locations(instance_id)
+            shopify_locations = self.search([('shopify_instance_id', '=', instance_id.id)])
+        shopify_location_by_stock_location = {}
+        for shopify_location in shopify_locations:
+            for stock_location in shopify_location._get_stock_locations():
+                shopify_location_by_stock_location.setdefault(stock_location.id, shopify_location.shopify_location_id)
+        if not shopify_location_by_stock_location and instance_id.location_id.shopify_location_id:
+            shopify_location_by_stock_location[instance_id.location_id.id] = instance_id.location_id.shopify_location_id
+        quantities = {(product.id, shopify_location_id): 0.0
+                      for product in products for shopify_location_id in set(shopify_location_by_stock_location.values())}
+        if not shopify_location_by_stock_location or not products:
+            return quantities
+
+        groups = self.env['stock.quant'].sudo()._read_group(
+            [('product_id', 'in', products.ids), ('location_id', 'child_of', list(shopify_location_by_stock_location))],
+            groupby=['product_id', 'location_id'], aggregates=['quantity:sum'])
+        resolved_locations = {}
+        for product, location, quantity in groups:
+            if location.id not in resolved_locations:
+                # parent_path is "1/7/12/", the deepest mapped ancestor wins
+                ancestor_ids = [int(location_id) for location_id in location.parent_path.split('/') if location_id]
+                resolved_locations[location.id] = next((shopify_location_by_stock_location[ancestor_id]
+                                                        for ancestor_id in reversed(ancestor_ids)
+                                                        if ancestor_id in shopify_location_by_stock_location), None)
+            shopify_location_id = resolved_locations[location.id]
+            if shopify_location_id:
+                quantities[(product.id, shopify_location_id)] += quantity
+        return quantities
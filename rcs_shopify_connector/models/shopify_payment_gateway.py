@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from .shopify_queue_line import ShopifyTransientError
+import requests
+import logging
+
+_logger = logging.getLogger(">>> Shopify Payment Gateway <<<")
+
+NO_PAYMENT_GATEWAY = 'no_payment_gateway'
+
+
+class ShopifyPaymentGateway(models.Model):
+    _name = "shopify.payment.gateway"
+    _description = "Shopify Payment Gateway"
+    _rec_name = "name"
+
+    name = fields.Char(string="Name", required=True)
+    code = fields.Char(string="Code", required=True, help="Payment gateway name as sent by Shopify")
+    multi_shopify_connector_id = fields.Many2one('shopify.connector', string='Multi Shopify Connector', required=True, ondelete="cascade")
+    active = fields.Boolean(string="Active", default=True)
+
+    _sql_constraints = [
+        ('code_connector_uniq', 'unique(code, multi_shopify_connector_id)',
+         'A payment gateway can only be created once per Shopify instance.'),
+    ]
+
+    @api.model
+    def _register_shopify_gateway_names(self, gateway_names, instance_id):
+        """
+            Create the payment gateways not seen yet for a Shopify instance.
+            Called with every order so new gateways are discovered without scanning the store.
+            The insert runs in a savepoint, a gateway created concurrently raises ShopifyTransientError.
+            :param gateway_names: Iterable of Shopify payment gateway names.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Newly created shopify.payment.gateway records.
+        """
+        codes = {name for name in gateway_names if name}
+        if not codes:
+            return self
+        # One lookup on the (code, instance) unique index, a handful of names per order
+        known_codes = set(self.sudo().with_context(active_test=False).search(
+            [('multi_shopify_connector_id', '=', instance_id.id), ('code', 'in', list(codes))]).mapped('code'))
+        new_codes = codes - known_codes
+        if not new_codes:
+            return self
+        _logger.info("Creating payment gateways %s for instance %s.", ', '.join(sorted(new_codes)), instance_id.name)
+        # A gateway created by a parallel worker rolls back the savepoint only, the queue line is retried
+        return self.env['shopify.connector']._create_unique_shopify_record('shopify.payment.gateway', [{
+            'name': code,
+            'code': code,
+            'multi_shopify_connector_id': instance_id.id,
+        } for code in sorted(new_codes)])
+
+    @api.model
+    def create_shopify_payment_gateway(self, instance_id, limit=250):
+        """
+            Discover the payment gateways used by the Shopify orders of an instance.
+            Orders are paged by ID from the since_id watermark of the instance, so repeated calls
+            only read the orders created since the previous discovery.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param limit: Number of orders fetched per page.
+            :return: Newly created shopify.payment.gateway records.
+        """
+        shopify_connection = self.env['shopify.connector']
+        headers = {
+            "X-Shopify-Access-Token": instance_id.shopify_access_token
+        }
+        url = instance_id._get_shopify_api_url('orders')
+        since_id = instance_id.shopify_gateway_since_id or '0'
+        new_gateways = self
+        try:
+            while True:
+                params = {'status': 'any', 'fields': 'id,payment_gateway_names', 'limit': limit, 'since_id': since_id}
+                response = requests.get(url, headers=headers, params=params)
+                if response.status_code != 200:
+                    log_id = shopify_connection._create_common_process_log("Failed to fetch payment gateways from Shopify.", "shopify.payment.gateway", False, response.text)
+                    shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to fetch payment gateways. HTTP Error: {response.status_code}", 'error')
+                    break
+                orders = response.json().get('orders', [])
+                if not orders:
+                    break
+                gateway_names = set()
+                for order in orders:
+                    gateway_names.update(order.get('payment_gateway_names') or [NO_PAYMENT_GATEWAY])
+                new_gateways |= self._register_shopify_gateway_names(gateway_names, instance_id)
+                since_id = str(max(int(order.get('id')) for order in orders))
+                instance_id.write({'shopify_gateway_since_id': since_id})
+                if len(orders) < limit:
+                    break
+        except (requests.RequestException, ShopifyTransientError) as e:
+            # The discovery resumes from the watermark on the next call
+            log_id = shopify_connection._create_common_process_log("An error occurred while fetching payment gateways from Shopify.", "shopify.payment.gateway", False, str(e))
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, str(e), "An error occurred while fetching payment gateways from Shopify.", 'error')
+        _logger.info("Payment gateway discovery for %s stopped at order ID %s.", instance_id.name, since_id)
+        return new_gateways
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(">>> Shopify Import Product Image <<<")
+
+
+class ShopifyProductImage(models.Model):
+    _name = "shopify.product.image"
+    _description = "Shopify Product Image"
+    _rec_name = "name"
+    _order = "product_tmpl_id, position, id"
+
+    name = fields.Char(string="Name", compute="_compute_name")
+    shopify_image_id = fields.Char(string="Shopify Image ID")
+    src = fields.Char(string="Source URL")
+    content_hash = fields.Char(string="Content Hash", readonly=True, help="SHA-1 of the last downloaded image content")
+    position = fields.Integer(string="Position", default=1)
+    product_tmpl_id = fields.Many2one('product.template', string="Product Template", ondelete="cascade", index=True)
+    product_ids = fields.Many2many('product.product', string="Product Variants")
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance')
+    state = fields.Selection([('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')],
+                             string="State", default='pending', index=True)
+
+    @api.depends('src')
+    def _compute_name(self):
+        """ Use the file name of the source URL as image name. """
+        for image in self:
+            image.name = (image.src or '').split('?')[0].rsplit('/', 1)[-1]
+
+    @api.model
+    def _schedule_shopify_images(self, templates_data, instance_id):
+        """
+            Register the images of a chunk of Shopify products for the deferred image fetch.
+            Images whose source URL did not change keep their state and are not downloaded again.
+            :param templates_data: List of (product.template record, Shopify product dictionary) tuples.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+        """
+        templates = self.env['product.template'].concat(*[template for template, product_data in templates_data])
+        existing_images = {(image.product_tmpl_id.id, image.shopify_image_id): image
+                           for image in self.search([('product_tmpl_id', 'in', templates.ids)])}
+        seen_images = self
+        new_image_vals = []
+        for template, product_data in templates_data:
+            variants_by_shopify_id = {variant.shopify_variant_id: variant for variant in template.product_variant_ids}
+            for image_data in product_data.get('images') or []:
+                variant_ids = [variants_by_shopify_id[str(variant_id)].id for variant_id in image_data.get('variant_ids') or []
+                               if str(variant_id) in variants_by_shopify_id]
+                vals = {
+                    'src': image_data.get('src'),
+                    'position': image_data.get('position') or 1,
+                    'product_ids': [(6, 0, variant_ids)],
+                }
+                image = existing_images.get((template.id, str(image_data.get('id'))))
+                if image:
+                    seen_images |= image
+                    if image.src != vals['src'] or image.position != vals['position'] or set(image.product_ids.ids) != set(variant_ids):
+                        vals['state'] = 'pending'
+                        if image.src == vals['src']:
+                            # Same content, only its assignment changed so it has to be applied again
+                            vals['content_hash'] = False
+                        image.write(vals)
+                    elif image.state == 'failed':
+                        image.state = 'pending'
+                else:
+                    vals.update({
+                        'shopify_image_id': str(image_data.get('id')),
+                        'product_tmpl_id': template.id,
+                        'shopify_instance_id': instance_id.id,
+                    })
+                    new_image_vals.append(vals)
+        if new_image_vals:
+            self.create(new_image_vals)
+        removed_images = self.concat(*existing_images.values()) - seen_images
+        if removed_images:
+            removed_images.unlink()
+
+    @staticmethod
+    def _download_shopify_image(src):
+        """
+            Download an image from the Shopify CDN, runs outside of the ORM in a worker thread.
+            :param src: Image URL.
+            :return: Tuple (src, content or None, error message or None).
+        """
+        try:
+            response = requests.get(src, timeout=30)
+            if response.status_code == 200:
+                return src, response.content, None
+            return src, None, f"HTTP Error: {response.status_code}"
+        except requests.RequestException as e:
+            return src, None, str(e)
+
+    def _apply_shopify_image(self, content, content_hash):
+        """
+            Set the downloaded image on the template and its variants.
+            Variants sharing the main image of the template keep using the template image.
+            :param content: Raw image content.
+            :param content_hash: SHA-1 of the image content.
+        """
+        self.ensure_one()
+        image_base64 = base64.b64encode(content)
+        template = self.product_tmpl_id
+        if self.position == 1:
+            template.write({'image_1920': image_base64})
+        if self.product_ids:
+            main_image = self.search([('product_tmpl_id', '=', template.id), ('position', '=', 1)], limit=1)
+            if main_image.content_hash == content_hash and main_image != self:
+                self.product_ids.write({'image_variant_1920': False})
+            else:
+                self.product_ids.write({'image_variant_1920': image_base64})
+        self.write({'content_hash': content_hash, 'state': 'done'})
+
+    @api.model
+    def cron_fetch_shopify_images(self, limit=500, max_workers=4):
+        """
+            Cron job method to download the pending Shopify product images in the background.
+            Each distinct URL is downloaded once with a bounded number of concurrent requests,
+            images with an unchanged content hash are not written again.
+            :param limit: Maximum number of images handled per run.
+            :param max_workers: Maximum number of concurrent downloads.
+        """
+        shopify_connection = self.env['shopify.connector']
+        images = self.search([('state', '=', 'pending')], limit=limit, order='position, id')
+        if not images:
+            return True
+        sources = list(set(images.mapped('src')))
+        _logger.info("Downloading %d Shopify product images.", len(sources))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            downloads = {src: (content, error) for src, content, error in executor.map(self._download_shopify_image, sources)}
+
+        log_id = False
+        for image in images:
+            content, error = downloads.get(image.src, (None, 'Missing source URL'))
+            if content is None:
+                image.state = 'failed'
+                log_id = log_id or shopify_connection._create_common_process_log("Failed to download product images from Shopify.", "product.template")
+                shopify_connection._create_common_process_log_line(log_id, image.name, image.product_tmpl_id, image.src, f"Failed to download image: {error}", 'error')
+                continue
+            content_hash = hashlib.sha1(content).hexdigest()
+            if content_hash == image.content_hash:
+                image.state = 'done'
+                continue
+            image._apply_shopify_image(content, content_hash)
+        self._cr.commit()
+        return True
@@ -1,6 +1,43 @@
 # -*- coding: utf-8 -*-
+from collections import defaultdict
 from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools.misc import split_every
+from .shopify_queue_line import ShopifyTransientError
+import logging
+import resource
+import time
+
+_logger = logging.getLogger(">>> Shopify Queue <<<")
+
+# Namespace of the advisory locks used as per-instance processing slots
+QUEUE_SLOT_LOCK_NAMESPACE = 7541
+# Lower is processed first: orders, then customers, then products
+QUEUE_MODEL_PRIORITY = {'sale_order': 0, 'res_partner': 1, 'product': 2}
+# Context of the queue processors: no tracking values, followers or chatter messages on imported records
+SHOPIFY_IMPORT_CONTEXT = {
+    'shopify_queue_processing': True,
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+    'mail_auto_subscribe_no_notify': True,
+}
+# Number of queue lines whose payloads are loaded in memory at once
+QUEUE_PAYLOAD_CHUNK_SIZE = 100
+
+
+def _get_current_memory():
+    """
+        Get the current resident memory of the worker, unlike ru_maxrss it goes down when memory is released.
+        :return: Resident memory in MB, 0.0 when /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return resident_pages * resource.getpagesize() / (1024.0 * 1024.0)
 
 
 class ShopifyQueue(models.Model):
@@ -31,6 +68,14 @@ class ShopifyQueue(models.Model):
     done_state_count = fields.Integer(compute="_compute_total_record_count")
     cancel_state_count = fields.Integer(compute="_compute_total_record_count")
     company_id = fields.Many2one('res.company', string='Company', default=_get_set_default_company)
+    priority = fields.Integer(string="Priority", compute="_compute_priority", store=True, index=True,
+                              help="Scheduling lane of the queue, orders are processed before customers before products.")
+
+    @api.depends("model_selection")
+    def _compute_priority(self):
+        """ Compute the scheduling lane from the queue model. """
+        for record in self:
+            record.priority = QUEUE_MODEL_PRIORITY.get(record.model_selection, 9)
 
     @api.depends("shopify_synced_queue_line_ids.state")
     def _compute_total_record_count(self):
@@ -58,25 +103,58 @@ class ShopifyQueue(models.Model):
                 record.state = "partially_completed"
 
     @api.model
-    def create(self, vals):
+    def _reserve_queue_names(self, model_selection, count):
         """
-            Override create method to set name and handle model-specific sequences.
+            Reserve the names of several queues of a model with a single sequence call.
             Args:
-                vals (dict): Values dictionary for creating the record.
+                model_selection (str): Type of data model ('res_partner', 'sale_order', 'product').
+                count (int): Number of names to reserve.
             Returns:
-                Created record.
-        """
-        model = vals.get('model_selection')
-        if model == 'res_partner':
-            seq = self.env["ir.sequence"].next_by_code("shopify.queue.customer") or "/"
-            vals.update({"name": seq or ""})
-        elif model == 'product':
-            seq = self.env["ir.sequence"].next_by_code("shopify.queue.product") or "/"
-            vals.update({"name": seq or ""})
+                list: Queue names.
+        """
+        sequence_codes = {'res_partner': 'shopify.queue.customer', 'product': 'shopify.queue.product'}
+        sequence_code = sequence_codes.get(model_selection, 'shopify.queue.order')
+        sequence = self.env['ir.sequence'].sudo().search([
+            ('code', '=', sequence_code), ('company_id', 'in', [self.env.company.id, False])], order='company_id', limit=1)
+        if not sequence or sequence.use_date_range:
+            return [self.env["ir.sequence"].next_by_code(sequence_code) or "/" for index in range(count)]
+        if sequence.implementation == 'standard':
+            self.env.cr.execute("SELECT nextval('ir_sequence_%03d') FROM generate_series(1, %%s)" % sequence.id, [count])
+            numbers = [row[0] for row in self.env.cr.fetchall()]
         else:
-            seq = self.env["ir.sequence"].next_by_code("shopify.queue.order") or "/"
-            vals.update({"name": seq or ""})
-        return super(ShopifyQueue, self).create(vals)
+            self.env.cr.execute("SELECT number_next FROM ir_sequence WHERE id = %s FOR UPDATE NOWAIT", [sequence.id])
+            number_next = self.env.cr.fetchone()[0]
+            self.env.cr.execute("UPDATE ir_sequence SET number_next = number_next + %s WHERE id = %s",
+                                [sequence.number_increment * count, sequence.id])
+            sequence.invalidate_recordset(['number_next'])
+            numbers = [number_next + index * sequence.number_increment for index in range(count)]
+        return [sequence.get_next_char(number) for number in numbers]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """
+            Override create method to set name and handle model-specific sequences.
+            Names are reserved per model in one sequence call for the whole batch.
+            Args:
+                vals_list (list): Values dictionaries for creating the records.
+            Returns:
+                Created records.
+        """
+        vals_by_model = defaultdict(list)
+        for vals in vals_list:
+            if not vals.get('name'):
+                vals_by_model[vals.get('model_selection') or 'res_partner'].append(vals)
+        for model, model_vals_list in vals_by_model.items():
+            for vals, name in zip(model_vals_list, self._reserve_queue_names(model, len(model_vals_list))):
+                vals.update({"name": name or ""})
+        return super(ShopifyQueue, self).create(vals_list)
+
+    def unlink(self):
+        """
+            Remove the lines through the ORM first, so their draft lines leave the instance backlog.
+        """
+        self.shopify_synced_queue_line_ids.unlink()
+        return super(ShopifyQueue, self).unlink()
 
     @api.model
     def create_queue(self, instance, model_selection):
@@ -90,57 +168,161 @@ class ShopifyQueue(models.Model):
         """
         queue_vals = {
             "shopify_instance_id": instance and instance.id or False,
-            "model_selection": model_selection
+            "model_selection": model_selection,
         }
         return self.create(queue_vals)
 
-    def process_queue_manually(self):
+    @api.model
+    def create_data_queues(self, data, instance, model_selection):
         """
-           Process queue lines manually based on selected model type.
+           Split Shopify data in queues of the chunk size of the instance.
+           All queues are created in one call and all their lines in another, then committed.
+           Args:
+               data (list): List of Shopify data dictionaries to be queued.
+               instance (shopify.connector): Shopify instance object.
+               model_selection (str): Type of data model ('res_partner', 'sale_order', 'product').
+           Returns:
+               odoo.models.Model: Created queues.
+        """
+        queue_line_obj = self.env["shopify.queue.line"]
+        if not data:
+            return self.browse()
+        chunks = list(split_every(instance.queue_chunk_size or 125, data))
+        queues = self.create([{
+            "shopify_instance_id": instance.id,
+            "model_selection": model_selection,
+        } for chunk in chunks])
+        queue_line_obj.create([queue_line_obj._prepare_queue_line_vals(queue, line_data, instance, model_selection)
+                               for queue, chunk in zip(queues, chunks) for line_data in chunk])
+        self.env['shopify.instance.statistics']._record_enqueued(instance, model_selection, len(data))
+        self._cr.commit()
+        return queues
 
-           This method iterates over queue line items and attempts to process them
-           according to the selected model type ('res_partner', 'product', 'sale_order').
-           It updates the state of each queue line based on success or failure.
+    def action_process_queue(self):
+        """
+           Process the queue from its form, within the processing slots of its instance
+           so a manual run never exceeds the concurrency limit shared with the queue workers.
+        """
+        self.ensure_one()
+        slot = self._acquire_instance_slot(self.shopify_instance_id)
+        if slot is None:
+            raise UserError(_("All processing slots of instance %s are busy, the queue will be processed by the queue workers.")
+                            % self.shopify_instance_id.name)
+        try:
+            return self.process_queue_manually()
+        finally:
+            self._release_instance_slot(self.shopify_instance_id, slot)
+
+    def _process_queue_chunk(self, queue_lines, now):
+        """
+           Import a chunk of claimed queue lines, their payloads are only loaded for the chunk.
+           Args:
+               queue_lines (shopify.queue.line): Claimed lines of the queue.
+               now (datetime): Date of the processing run.
         """
         shopify_connection = self.env['shopify.connector']
         sale_order_obj = self.env['sale.order']
         partner_obj = self.env['res.partner']
         product_tmpl_obj = self.env['product.template']
+        synced_data_by_line = queue_lines._load_synced_data()
+        empty_lines = queue_lines.filtered(lambda line: line.id not in synced_data_by_line)
+        if empty_lines:
+            empty_lines.write({'state': 'cancel', 'last_error': 'Missing or unreadable Shopify data.', 'last_process_date': now})
+        lines_to_process = queue_lines - empty_lines
+
         if self.model_selection == "res_partner":
-            for record in self.shopify_synced_queue_line_ids:
+            for record in lines_to_process:
                 try:
-                    synced_data = eval(record.shopify_synced_data)
-                    partner_obj._create_or_update_customer(synced_data, record.shopify_instance_id)
-                    record.state = "done"
+                    with self.env.cr.savepoint():
+                        synced_data = synced_data_by_line[record.id]
+                        partner_obj._create_or_update_customer(synced_data, record.shopify_instance_id)
+                        record.write({'state': 'done', 'last_process_date': now})
+                except ShopifyTransientError as e:
+                    record._schedule_retry(str(e))
                 except Exception as e:
                     log_id = shopify_connection._create_common_process_log('Error: Customer import failed.', "res.partner", record, str(e))
                     log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', record, str(e), 'An error occurred while fetching customers from Shopify', 'error')
-                    record.state = "cancel"
+                    record.write({'state': 'cancel', 'last_error': str(e), 'last_process_date': now})
 
         if self.model_selection == "product":
-            for record in self.shopify_synced_queue_line_ids:
+            try:
+                with self.env.cr.savepoint():
+                    products_data = [synced_data_by_line[record.id] for record in lines_to_process]
+                    product_tmpl_obj._create_or_update_products(products_data, self.shopify_instance_id)
+                    lines_to_process.write({'state': 'done', 'last_process_date': now})
+            except Exception as e:
+                # Fall back to line by line processing so a faulty product only fails its own line
+                _logger.warning("Batch product import failed for queue %s, processing line by line: %s", self.name, str(e))
+            for record in lines_to_process.filtered(lambda line: line.state != 'done'):
                 try:
-                    synced_data = eval(record.shopify_synced_data)
-                    product_tmpl_obj._create_or_update_product(synced_data, record.shopify_instance_id)
-                    record.state = "done"
+                    with self.env.cr.savepoint():
+                        synced_data = synced_data_by_line[record.id]
+                        product_tmpl_obj._create_or_update_product(synced_data, record.shopify_instance_id)
+                        record.write({'state': 'done', 'last_process_date': now})
+                except ShopifyTransientError as e:
+                    record._schedule_retry(str(e))
                 except Exception as e:
                     log_id = shopify_connection._create_common_process_log("An error occurred while fetching products.", "product.template", record, str(e))
                     log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', record, str(e),  f"Failed to fetch products.", 'error')
-                    record.state = "cancel"
+                    record.write({'state': 'cancel', 'last_error': str(e), 'last_process_date': now})
 
         if self.model_selection == "sale_order":
-            for record in self.shopify_synced_queue_line_ids:
+            for record in lines_to_process:
                 try:
-                    synced_data = eval(record.shopify_synced_data)
-                    cancelled_at = synced_data.get('cancelled_at')
-                    if cancelled_at is None:
-                        record_id = {'record': record}
-                        sale_order_obj._create_or_update_orders(synced_data, record.shopify_instance_id, **record_id)
+                    with self.env.cr.savepoint():
+                        synced_data = synced_data_by_line[record.id]
+                        cancelled_at = synced_data.get('cancelled_at')
+                        if cancelled_at is None:
+                            record_id = {'record': record}
+                            sale_order_obj._create_or_update_orders(synced_data, record.shopify_instance_id, **record_id)
+                        else:
+                            # Nothing to import for orders cancelled on Shopify
+                            record.state = "done"
+                        record.last_process_date = now
+                except ShopifyTransientError as e:
+                    record._schedule_retry(str(e))
                 except Exception as e:
-                    record.state = "cancel"
+                    record.write({'state': 'cancel', 'last_error': str(e), 'last_process_date': now})
                     log_id = shopify_connection._create_common_process_log("An error occurred while fetching order.", "sale.order", record, str(e))
                     log_line_id = shopify_connection._create_common_process_log_line(log_id, 'Error', record, str(e), "An error occurred while fetching orders.", 'error')
 
+        del synced_data_by_line
+
+    def process_queue_manually(self):
+        """
+           Process queue lines manually based on selected model type.
+
+           Only the draft lines whose retry delay is over are processed, according to the
+           selected model type ('res_partner', 'product', 'sale_order'). Lines failing on a
+           transient Shopify error are retried later with an exponential backoff, lines failing
+           on their data are cancelled. Records are imported without mail tracking and a single
+           summary message is posted on the queue.
+        """
+        queue = self.with_context(**SHOPIFY_IMPORT_CONTEXT)
+        queue_line_obj = queue.env['shopify.queue.line']
+        queue_lines = queue_line_obj._claim_pending_lines(self)
+        if not queue_lines:
+            return True
+        now = fields.Datetime.now()
+        # Payloads are parsed and dropped chunk by chunk, so a large queue never holds them all in memory
+        for line_ids in split_every(QUEUE_PAYLOAD_CHUNK_SIZE, queue_lines.ids):
+            queue._process_queue_chunk(queue_line_obj.browse(line_ids), now)
+        self._post_processing_summary(queue_lines)
+        self.env['shopify.instance.statistics']._record_processing_run(self, queue_lines, now)
+        return True
+
+    def _post_processing_summary(self, queue_lines):
+        """
+            Post one chatter message summarizing a processing run of the queue.
+            Args:
+                queue_lines (shopify.queue.line): Lines handled during the run.
+        """
+        done_count = len(queue_lines.filtered(lambda line: line.state == "done"))
+        cancel_count = len(queue_lines.filtered(lambda line: line.state == "cancel"))
+        retry_count = len(queue_lines) - done_count - cancel_count
+        self.message_post(body=_("Processed %(total)s records: %(done)s done, %(cancel)s cancelled, %(retry)s scheduled for retry.",
+                                 total=len(queue_lines), done=done_count, cancel=cancel_count, retry=retry_count))
+
     def open_record_queue_data(self):
         """
             Open queue line records associated with this queue.
@@ -235,13 +417,102 @@ class ShopifyQueue(models.Model):
                 action['views'] = [(view_tree_id, 'tree'), (view_form_id, 'form')]
             return action
 
-    def cron_all_record_completed(self):
+    def _acquire_instance_slot(self, instance):
+        """
+            Take one of the processing slots of a Shopify instance.
+            Slots are session advisory locks, so the concurrency cap holds across cron workers.
+            Args:
+                instance (shopify.connector): Shopify instance object.
+            Returns:
+                int or None: The acquired slot number, None when every slot is busy.
+        """
+        for slot in range(max(instance.queue_concurrency_limit, 1)):
+            self.env.cr.execute("SELECT pg_try_advisory_lock(%s, %s)",
+                                [QUEUE_SLOT_LOCK_NAMESPACE, instance.id * 1000 + slot])
+            if self.env.cr.fetchone()[0]:
+                return slot
+        return None
+
+    def _release_instance_slot(self, instance, slot):
+        """
+            Release a processing slot taken with _acquire_instance_slot.
+            Args:
+                instance (shopify.connector): Shopify instance object.
+                slot (int): The slot number to release.
+        """
+        self.env.cr.execute("SELECT pg_advisory_unlock(%s, %s)",
+                            [QUEUE_SLOT_LOCK_NAMESPACE, instance.id * 1000 + slot])
+
+    @api.model
+    def _schedule_queues(self, queues):
+        """
+            Order queues fairly between Shopify instances.
+            The next queue is always taken from the lowest priority lane, instances having a queue in
+            that lane are served round-robin so a large backfill of one store cannot starve the others.
+            Args:
+                queues (shopify.queue): Queues to schedule.
+            Returns:
+                list: Queues in processing order.
+        """
+        queues_by_instance = defaultdict(list)
+        for queue in queues.sorted(lambda q: (q.priority, q.id)):
+            queues_by_instance[queue.shopify_instance_id].append(queue)
+        last_served = dict.fromkeys(queues_by_instance, -1)
+        scheduled_queues = []
+        while queues_by_instance:
+            instance = min(queues_by_instance, key=lambda inst: (queues_by_instance[inst][0].priority, last_served[inst], inst.id))
+            scheduled_queues.append(queues_by_instance[instance].pop(0))
+            last_served[instance] = len(scheduled_queues)
+            if not queues_by_instance[instance]:
+                del queues_by_instance[instance]
+        return scheduled_queues
+
+    def cron_all_record_completed(self, time_limit=480):
         """
             Cron job method to process all Shopify queues that are in 'draft' or 'partially_completed' state.
-            This method searches for all Shopify queue records that are either in 'draft' or 'partially_completed' state.
-            For each queue record found, it invokes the 'process_queue_manually' method to process its queue lines
-            manually and update their states based on the processing results.
+            Queues are processed by priority lane and round-robin between Shopify instances, each instance
+            being limited to its number of concurrent processing slots. Every processed queue is committed,
+            then the environment cache is cleared so memory stays flat over long backlogs.
+            The run stops taking queues after the time limit, the rest is left for the next run.
+            :param time_limit: Seconds after which no new queue is started, below the cron interval.
         """
+        deadline = time.monotonic() + time_limit
+        memory_start = _get_current_memory()
         queues = self.env['shopify.queue'].search([('state', 'in', ['draft', 'partially_completed'])])
-        for rec in queues:
-            rec.process_queue_manually()
+        # Keep plain IDs only, so processed records are not kept alive through the scheduled recordsets
+        schedule = [(queue.id, queue.shopify_instance_id.id) for queue in self._schedule_queues(queues)]
+        del queues
+        self.env.invalidate_all()
+        busy_instances = set()
+        processed_count = 0
+        for queue_id, instance_id in schedule:
+            if time.monotonic() >= deadline:
+                _logger.info("Queue processing time limit reached, the remaining queues are left for the next run.")
+                break
+            if instance_id in busy_instances:
+                continue
+            rec = self.browse(queue_id)
+            instance = rec.shopify_instance_id
+            slot = self._acquire_instance_slot(instance)
+            if slot is None:
+                _logger.info("All processing slots of instance %s are busy, skipping its queues.", instance.name)
+                busy_instances.add(instance_id)
+                continue
+            memory_before = _get_current_memory()
+            try:
+                rec.process_queue_manually()
+                self._cr.commit()
+                processed_count += 1
+            except Exception as e:
+                self._cr.rollback()
+                _logger.error("Failed to process queue %s: %s", rec.name, str(e), exc_info=True)
+            finally:
+                self._release_instance_slot(instance, slot)
+                del rec, instance
+                self.env.invalidate_all()
+                memory_after = _get_current_memory()
+                _logger.info("Shopify queue %s processed, worker memory %.1f MB (%+.1f MB).",
+                             queue_id, memory_after, memory_after - memory_before)
+        memory_end = _get_current_memory()
+        _logger.info("Processed %d Shopify queues, worker memory %.1f MB (%+.1f MB over the run).",
+                     processed_count, memory_end, memory_end - memory_start)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import ast
+from datetime import timedelta
+from odoo import models, fields, api, _
+import logging
+
+_logger = logging.getLogger(">>> Shopify Queue Line <<<")
+
+# Delay before the first retry of a transient failure, doubled on every attempt
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+
+class ShopifyTransientError(Exception):
+    """ Temporary Shopify failure (network error, rate limit or server error), the queue line is retried later. """
+
+
+def is_transient_status(status_code):
+    """
+        Tell whether an HTTP status code returned by Shopify is worth retrying.
+        :param status_code: HTTP status code.
+        :return: True for rate limiting (429) and server errors (5xx).
+    """
+    return status_code == 429 or status_code >= 500
+
+
+class ShopifyQueueLine(models.Model):
+    """ This model is used to store the Shopify data waiting to be imported."""
+    _name = "shopify.queue.line"
+    _description = "Shopify Queue Line"
+    _rec_name = "name"
+
+    name = fields.Char(string="Name")
+    shopify_data_id = fields.Char(string="Shopify Data ID")
+    shopify_synced_queue_id = fields.Many2one("shopify.queue", string="Shopify Queue", ondelete="cascade", index=True)
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance')
+    # Not prefetched: reading line states must not load every payload of the queue
+    shopify_synced_data = fields.Text(string="Shopify Data", prefetch=False)
+    state = fields.Selection([("draft", "Draft"), ("done", "Done"), ("cancel", "Cancelled")],
+                             default="draft", index=True)
+    last_process_date = fields.Datetime(string="Last Processed On", readonly=True)
+    retry_count = fields.Integer(string="Retries", default=0, readonly=True)
+    next_attempt_date = fields.Datetime(string="Next Attempt On", readonly=True, index=True)
+    last_error = fields.Text(string="Last Error", readonly=True)
+
+    @api.model
+    def _get_shopify_data_name(self, data, model_selection):
+        """
+            Get a readable name for queued Shopify data.
+            :param data: Dictionary containing Shopify data.
+            :param model_selection: Type of data model ('res_partner', 'sale_order', 'product').
+            :return: Name of the queue line.
+        """
+        if model_selection == 'res_partner':
+            name = f"{data.get('first_name') or ''} {data.get('last_name') or ''}".strip()
+            return name or data.get('email') or str(data.get('id'))
+        if model_selection == 'product':
+            return data.get('title') or str(data.get('id'))
+        return data.get('name') or str(data.get('id'))
+
+    @api.model
+    def _prepare_queue_line_vals(self, queue, data, instance, model_selection):
+        """
+            Prepare the values of the queue line of a Shopify record.
+            :param queue: Shopify queue record receiving the line.
+            :param data: Shopify data dictionary.
+            :param instance: Shopify instance ID (shopify.connector record).
+            :param model_selection: Type of data model ('res_partner', 'sale_order', 'product').
+            :return: Dictionary of queue line values.
+        """
+        return {
+            'name': self._get_shopify_data_name(data, model_selection),
+            'shopify_data_id': str(data.get('id')),
+            'shopify_synced_queue_id': queue.id,
+            'shopify_instance_id': instance.id,
+            'shopify_synced_data': str(data),
+        }
+
+    @api.model
+    def shopify_create_multi_queue(self, queue, data_chunk, instance, model_selection):
+        """
+            Create the queue lines of a chunk of Shopify data.
+            :param queue: Shopify queue record receiving the lines.
+            :param data_chunk: List of Shopify data dictionaries.
+            :param instance: Shopify instance ID (shopify.connector record).
+            :param model_selection: Type of data model ('res_partner', 'sale_order', 'product').
+            :return: Created shopify.queue.line records.
+        """
+        queue_lines = self.create([self._prepare_queue_line_vals(queue, data, instance, model_selection) for data in data_chunk])
+        self.env['shopify.instance.statistics']._record_enqueued(instance, model_selection, len(queue_lines))
+        return queue_lines
+
+    def unlink(self):
+        """
+            Remove the deleted draft lines from the backlog of their instance.
+        """
+        draft_groups = self._read_group([('id', 'in', self.ids), ('state', '=', 'draft')],
+                                        groupby=['shopify_instance_id', 'shopify_synced_queue_id'], aggregates=['__count'])
+        removed_backlog = [(instance, queue.model_selection, count) for instance, queue, count in draft_groups]
+        res = super(ShopifyQueueLine, self).unlink()
+        statistics = self.env['shopify.instance.statistics']
+        for instance, model_selection, count in removed_backlog:
+            statistics._record_removed(instance, model_selection, count)
+        return res
+
+    def _load_synced_data(self):
+        """
+            Load and parse the payloads of the lines in one query, without keeping them in the ORM cache.
+            Payloads are stored as Python literals and parsed without evaluating any code,
+            empty or unreadable payloads are left out.
+            :return: Dictionary mapping the line ID to its Shopify data.
+        """
+        if not self:
+            return {}
+        self.env.cr.execute("SELECT id, shopify_synced_data FROM shopify_queue_line WHERE id IN %s", [tuple(self.ids)])
+        synced_data_by_line = {}
+        for line_id, data in self.env.cr.fetchall():
+            if not data:
+                continue
+            try:
+                synced_data_by_line[line_id] = ast.literal_eval(data)
+            except (ValueError, SyntaxError):
+                _logger.warning("Unreadable Shopify data on queue line %s.", line_id)
+        return synced_data_by_line
+
+    @api.model
+    def _claim_pending_lines(self, queue):
+        """
+            Lock the lines of a queue that can be processed now.
+            Only draft lines whose retry delay is over are returned, lines locked by another worker are skipped.
+            :param queue: Shopify queue record.
+            :return: Claimed shopify.queue.line records.
+        """
+        self.env.cr.execute("""
+            SELECT id FROM shopify_queue_line
+             WHERE shopify_synced_queue_id = %s
+               AND state = 'draft'
+               AND (next_attempt_date IS NULL OR next_attempt_date <= (now() at time zone 'UTC'))
+             ORDER BY id
+               FOR UPDATE SKIP LOCKED
+        """, [queue.id])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _schedule_retry(self, error, max_retries=5):
+        """
+            Keep lines that failed on a transient error pending with an exponential backoff.
+            Lines exceeding max_retries are cancelled.
+            :param error: Error message of the failure.
+            :param max_retries: Number of retries before the lines are cancelled.
+            :return: Lines cancelled because they ran out of retries.
+        """
+        now = fields.Datetime.now()
+        exhausted_lines = self.browse()
+        for line in self:
+            retry_count = line.retry_count + 1
+            if retry_count > max_retries:
+                exhausted_lines |= line
+                line.write({'state': 'cancel', 'last_error': error, 'last_process_date': now})
+                continue
+            delay = min(RETRY_BASE_DELAY * 2 ** (retry_count - 1), RETRY_MAX_DELAY)
+            line.write({
+                'retry_count': retry_count,
+                'next_attempt_date': now + timedelta(seconds=delay),
+                'last_error': error,
+                'last_process_date': now,
+            })
+        return exhausted_lines
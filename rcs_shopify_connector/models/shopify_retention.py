@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import base64
+import gzip
+import json
+from collections import Counter
+from datetime import timedelta
+from odoo import models, fields, api
+from odoo.tools.misc import split_every
+import logging
+
+_logger = logging.getLogger(">>> Shopify Retention <<<")
+
+# Default retention ages in days, overridden in the settings through these system parameters
+RETENTION_PARAMETERS = {
+    'done_days': ('rcs_shopify_connector.retention_done_days', 30),
+    'cancel_days': ('rcs_shopify_connector.retention_cancel_days', 90),
+    'success_log_days': ('rcs_shopify_connector.retention_success_log_days', 30),
+    'error_log_days': ('rcs_shopify_connector.retention_error_log_days', 90),
+}
+
+
+class ShopifyRetentionSummary(models.Model):
+    """ Daily counts of the queue lines and process logs removed by the retention cron."""
+    _name = "shopify.retention.summary"
+    _description = "Shopify Retention Summary"
+    _order = "date desc, id desc"
+
+    date = fields.Date(string="Date", required=True, index=True, help="Creation day of the removed records")
+    shopify_instance_id = fields.Many2one('shopify.connector', string='Shopify Instance', ondelete="cascade")
+    record_type = fields.Char(string="Record Type", required=True,
+                              help="Queue model of the removed queue lines, or model of the removed process logs")
+    state = fields.Char(string="State", required=True)
+    record_count = fields.Integer(string="Removed Records", default=0)
+
+    _sql_constraints = [
+        ('retention_summary_uniq', 'unique(date, shopify_instance_id, record_type, state)',
+         'Only one retention summary per day, instance, record type and state is allowed.'),
+    ]
+
+    @api.model
+    def _add_to_summary(self, counts):
+        """
+            Add removed record counts to the summary rows.
+            :param counts: Counter of (date, instance ID, record type, state) keys.
+        """
+        for (date, instance_id, record_type, state), count in counts.items():
+            summary = self.search([('date', '=', date), ('shopify_instance_id', '=', instance_id),
+                                   ('record_type', '=', record_type), ('state', '=', state)], limit=1)
+            if summary:
+                summary.record_count += count
+            else:
+                self.create({
+                    'date': date,
+                    'shopify_instance_id': instance_id,
+                    'record_type': record_type,
+                    'state': state,
+                    'record_count': count,
+                })
+
+    @api.model
+    def _archive_queue_line_payloads(self, queue_lines):
+        """
+            Store the payloads of queue lines in one gzip compressed JSON attachment per queue.
+            :param queue_lines: shopify.queue.line records about to be removed.
+        """
+        archived_at = fields.Datetime.now().strftime('%Y%m%d%H%M%S')
+        # Payloads are not prefetched, they are read for the whole batch in one query
+        self.env.cr.execute("SELECT id, shopify_synced_data FROM shopify_queue_line WHERE id IN %s", [tuple(queue_lines.ids)])
+        payload_by_line = dict(self.env.cr.fetchall())
+        for queue in queue_lines.shopify_synced_queue_id:
+            lines = queue_lines.filtered(lambda line: line.shopify_synced_queue_id == queue)
+            payload = json.dumps([{
+                'name': line.name,
+                'shopify_data_id': line.shopify_data_id,
+                'state': line.state,
+                'last_error': line.last_error,
+                'data': payload_by_line.get(line.id),
+            } for line in lines]).encode()
+            self.env['ir.attachment'].sudo().create({
+                'name': f"{queue.name}-{archived_at}.json.gz",
+                'res_model': 'shopify.queue',
+                'res_id': queue.id,
+                'mimetype': 'application/gzip',
+                'datas': base64.b64encode(gzip.compress(payload)),
+            })
+
+    @api.model
+    def _purge_queue_lines(self, state, days, archive, batch_size):
+        """
+            Remove the queue lines of a state older than the retention age, in committed batches.
+            :param state: Queue line state ('done' or 'cancel').
+            :param days: Retention age in days, 0 keeps the lines forever.
+            :param archive: Whether payloads are compressed into queue attachments before removal.
+            :param batch_size: Number of lines removed per transaction.
+            :return: Number of removed lines.
+        """
+        if not days:
+            return 0
+        limit_date = fields.Datetime.now() - timedelta(days=days)
+        line_ids = self.env['shopify.queue.line'].search([('state', '=', state), ('create_date', '<', limit_date)]).ids
+        for batch_ids in split_every(batch_size, line_ids):
+            queue_lines = self.env['shopify.queue.line'].browse(batch_ids)
+            if archive:
+                self._archive_queue_line_payloads(queue_lines)
+            self._add_to_summary(Counter(
+                (line.create_date.date(), line.shopify_instance_id.id, line.shopify_synced_queue_id.model_selection or 'unknown', line.state)
+                for line in queue_lines))
+            queue_lines.unlink()
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        return len(line_ids)
+
+    @api.model
+    def _purge_process_logs(self, state, days, batch_size):
+        """
+            Remove the Shopify process logs older than the retention age, in committed batches.
+            A log is in error when one of its lines is, otherwise it is successful.
+            :param state: Log state ('success' or 'error').
+            :param days: Retention age in days, 0 keeps the logs forever.
+            :param batch_size: Number of logs removed per transaction.
+            :return: Number of removed logs.
+        """
+        if not days:
+            return 0
+        log_model = self.env['common.process.log'].sudo()
+        limit_date = fields.Datetime.now() - timedelta(days=days)
+        domain = [('resource_log', '=', 'shopify_connector'), ('create_date', '<', limit_date)]
+        error_domain = [('line_ids.state', '=', 'error')]
+        domain += error_domain if state == 'error' else [('id', 'not in', log_model._search(error_domain))]
+        log_ids = log_model.search(domain).ids
+        for batch_ids in split_every(batch_size, log_ids):
+            logs = log_model.browse(batch_ids)
+            self._add_to_summary(Counter((log.create_date.date(), False, log.res_model or 'unknown', state) for log in logs))
+            logs.line_ids.unlink()
+            logs.unlink()
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        return len(log_ids)
+
+    @api.model
+    def _purge_empty_queues(self, days):
+        """
+            Remove the queues left without lines, except the ones holding archived payloads.
+            :param days: Age in days before an empty queue is removed.
+            :return: Number of removed queues.
+        """
+        limit_date = fields.Datetime.now() - timedelta(days=days)
+        queues = self.env['shopify.queue'].search([('create_date', '<', limit_date),
+                                                   ('shopify_synced_queue_line_ids', '=', False)])
+        archived_queue_ids = set(self.env['ir.attachment'].sudo().search(
+            [('res_model', '=', 'shopify.queue'), ('res_id', 'in', queues.ids)]).mapped('res_id'))
+        queues = queues.filtered(lambda queue: queue.id not in archived_queue_ids)
+        count = len(queues)
+        queues.unlink()
+        return count
+
+    @api.model
+    def _get_retention_days(self):
+        """
+            Get the retention ages configured in the settings.
+            :return: Dictionary of retention ages in days, 0 keeps the records forever.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        retention_days = {}
+        for name, (parameter, default) in RETENTION_PARAMETERS.items():
+            try:
+                retention_days[name] = max(int(get_param(parameter, default)), 0)
+            except ValueError:
+                _logger.warning("Invalid value of system parameter %s, using %s days.", parameter, default)
+                retention_days[name] = default
+        return retention_days
+
+    @api.model
+    def cron_apply_shopify_retention(self, archive_cancelled=True, batch_size=1000):
+        """
+            Cron job method removing old queue lines and process logs with a retention age per state.
+            The retention ages are configured in the settings. Draft queue lines are never removed.
+            Removed records are counted in the daily summary.
+            :param archive_cancelled: Compress cancelled payloads into queue attachments before removal.
+            :param batch_size: Number of records removed per transaction.
+        """
+        retention_days = self._get_retention_days()
+        done_days, cancel_days = retention_days['done_days'], retention_days['cancel_days']
+        removed = {
+            'done lines': self._purge_queue_lines('done', done_days, False, batch_size),
+            'cancelled lines': self._purge_queue_lines('cancel', cancel_days, archive_cancelled, batch_size),
+            'successful logs': self._purge_process_logs('success', retention_days['success_log_days'], batch_size),
+            'error logs': self._purge_process_logs('error', retention_days['error_log_days'], batch_size),
+        }
+        queue_days = [days for days in (done_days, cancel_days) if days]
+        if queue_days:
+            removed['empty queues'] = self._purge_empty_queues(max(queue_days))
+        self.env.cr.commit()
+        _logger.info("Shopify retention removed %s.", ", ".join(f"{count} {name}" for name, count in removed.items()))
+        return True
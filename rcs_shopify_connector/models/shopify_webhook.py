@@ -8,6 +8,18 @@ import logging
 
 _LOGGER = logging.getLogger(">>> Shopify Import Webhook <<<")
 
+# Route of this module receiving each Shopify webhook topic
+SHOPIFY_WEBHOOK_ROUTES = {
+    'orders/create': "/rcs_shopify_order_create_hook",
+    'orders/updated': "/rcs_shopify_order_update_hook",
+    'customers/create': "/rcs_shopify_customer_create_hook",
+    'customers/delete': "/rcs_shopify_customer_delete_hook",
+    'customers/update': "/rcs_shopify_customer_update_hook",
+    'products/create': "/rcs_shopify_product_create_hook",
+    'products/update': "/rcs_shopify_product_update_hook",
+    'products/delete': "/rcs_shopify_product_delete_hook",
+}
+
 
 class ShopifyWebhook(models.Model):
     _name = "shopify.webhook"
@@ -48,146 +60,152 @@ class ShopifyWebhook(models.Model):
         res.create_webhook_details()
         return res
 
+    def write(self, vals):
+        """
+            Override write method to prevent duplicate webhooks and move the Shopify subscription when the operation changes.
+            :param vals: Dictionary of field values to update.
+            :raises: ValidationError if a webhook with the same operations and instance exists.
+            :return: True
+        """
+        if 'operations' in vals or 'shopify_instance_id' in vals:
+            targets = set()
+            for webhook in self:
+                target = (vals.get('shopify_instance_id', webhook.shopify_instance_id.id), vals.get('operations', webhook.operations))
+                existing_webhook_id = self.search(
+                    [('shopify_instance_id', '=', target[0]), ('operations', '=', target[1]), ('id', 'not in', self.ids)], limit=1)
+                if existing_webhook_id or target in targets:
+                    raise ValidationError(_('Webhook is already created with the same operations.'))
+                targets.add(target)
+        res = super(ShopifyWebhook, self).write(vals)
+        if 'operations' in vals:
+            self.create_webhook_details()
+        return res
+
     def create_webhook_details(self):
         """
-        Create Shopify webhook details by sending a POST request to Shopify.
-        :return: True if successful.
-        :raises: ValidationError if HTTP protocol is not HTTPS.
+            Subscribe the webhooks on Shopify by reconciling the subscriptions of their instances.
+            :return: True
+        """
+        for shopify_instance_id in self.shopify_instance_id:
+            self.reconcile_shopify_webhooks(shopify_instance_id)
+        return True
+
+    @api.model
+    def reconcile_shopify_webhooks(self, shopify_instance_id):
+        """
+            Bring the Shopify webhook subscriptions of an instance in line with its webhook records.
+            The subscriptions are listed with one request, then only the missing ones are created, the ones
+            pointing to another address are updated and the ones of this module for topics no longer
+            configured are deleted. Running it again without changes sends no other request.
+            Only the subscriptions pointing to this database are managed: the routes on the current base URL
+            and the addresses previously registered by the webhook records.
+            :param shopify_instance_id: Shopify instance ID (shopify.connector record).
+            :return: Dictionary with the number of created, updated and deleted subscriptions.
         """
         shopify_connection = self.env['shopify.connector']
-        for record in self:
-            try:
-                shopify_instance_id = record.shopify_instance_id
-                if shopify_instance_id.state != "integrated":
-                    raise ValidationError("Shopify instance is not connected. Please connect Shopify instance first.")
-
-                # base_url = 'https://64e8-150-129-104-231.ngrok-free.app'
-                base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
-                operations = record.shopify_operation_url_hook()
-                url = base_url + operations
-                if url[:url.find(":")] == 'http':
-                    raise ValidationError("Address protocol http:// is not supported for creating the webhooks. "
-                                          "Only instances having SSL connection https:// are permitted.")
-                headers = {
-                    'X-Shopify-Access-Token': shopify_instance_id.shopify_access_token,
-                    'Content-Type': 'application/json'
-                }
-                payload = json.dumps({
-                    "webhook": {
-                        "address": url,
-                        "topic": record.operations,
-                        "format": "json"
-                    }
-                })
-                shopify_url = record.truncate_shopify_store_url_webhook(shopify_instance_id.shopify_host, shopify_instance_id)
-                response = requests.post(shopify_url, headers=headers, data=payload)
-                if response.status_code == 201:
-                    response_data = response.json()
-                    webhook_id = response_data["webhook"]['id']
-                    record.write({"webhook_id": webhook_id, 'base_url': url, 'state': 'active'})
-                    log_id = shopify_connection._create_common_process_log( f"Successfully created { record.operations} webhook from Shopify.", "shopify.webhook", record, response_data)
-                    log_line_id = shopify_connection._create_common_process_log_line(log_id,  record.operations, record, response_data, f"Successfully created webhook from Shopify.", 'success')
+        summary = {'created': 0, 'updated': 0, 'deleted': 0}
+        webhooks = self.search([('shopify_instance_id', '=', shopify_instance_id.id)])
+        if shopify_instance_id.state != "integrated":
+            log_id = shopify_connection._create_common_process_log("Shopify instance is not connected. Please connect Shopify instance first.", "shopify.webhook", False, shopify_instance_id.name)
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, shopify_instance_id.name, "Shopify instance is not connected. Please connect Shopify instance first.", 'error')
+            return summary
+        base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
+        if base_url[:base_url.find(":")] == 'http':
+            message = ("Address protocol http:// is not supported for creating the webhooks. "
+                       "Only instances having SSL connection https:// are permitted.")
+            log_id = shopify_connection._create_common_process_log("Validation Error occurred.", "shopify.webhook", False, message)
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, message, "Validation Error occurred.", 'error')
+            webhooks.write({'state': 'disabled'})
+            return summary
+        headers = {
+            'X-Shopify-Access-Token': shopify_instance_id.shopify_access_token,
+            'Content-Type': 'application/json'
+        }
+        log_id = shopify_connection._create_common_process_log("Reconcile webhooks with Shopify.", "shopify.webhook")
+        try:
+            response = requests.get(shopify_instance_id._get_shopify_api_url('webhooks'), headers=headers,
+                                    params={'limit': 250, 'fields': 'id,topic,address'})
+            if response.status_code != 200:
+                shopify_connection._create_common_process_log_line(log_id, 'Error', None, response.text, f"Failed to list Shopify webhooks. HTTP Error: {response.status_code}", 'error')
+                return summary
+            # Subscriptions of other applications and other databases are left alone
+            our_addresses = {base_url + route for route in SHOPIFY_WEBHOOK_ROUTES.values()}
+            our_addresses |= set(webhooks.filtered('base_url').mapped('base_url'))
+            remote_by_topic = {}
+            obsolete = []
+            for subscription in response.json().get('webhooks', []):
+                if subscription.get('address') not in our_addresses:
+                    continue
+                if subscription.get('topic') in remote_by_topic:
+                    obsolete.append(subscription)
                 else:
-                    error_message = f"Failed to create  { record.operations} Shopify Webhook. Status code: {response.status_code}."
-                    log_id = shopify_connection._create_common_process_log(error_message, "shopify.webhook", record, response.text)
-                    log_line_id = shopify_connection._create_common_process_log_line(log_id, record.operations, record, response.text, error_message, 'error')
-
-            except ValidationError as ve:
-                log_id = shopify_connection._create_common_process_log("Validation Error occurred.", "shopify.webhook", record, str(ve))
-                log_line_id = shopify_connection._create_common_process_log_line(log_id, record.operations, record, str(ve), "Validation Error occurred.", 'error')
-
-
-            except Exception as e:
-                error_message = f"Error occurred: {str(e)}"
-                log_id = shopify_connection._create_common_process_log(error_message, "shopify.webhook", record, str(e))
-                log_line_id = shopify_connection._create_common_process_log_line(log_id, record.operations, record, str(e), error_message, 'error')
+                    remote_by_topic[subscription.get('topic')] = subscription
+
+            for webhook in webhooks:
+                address = base_url + webhook.shopify_operation_url_hook()
+                subscription = remote_by_topic.pop(webhook.operations, None)
+                payload = json.dumps({"webhook": {"address": address, "topic": webhook.operations, "format": "json"}})
+                if subscription and subscription.get('address') == address:
+                    result = subscription
+                elif subscription:
+                    response = requests.put(shopify_instance_id._get_shopify_api_url(f"webhooks/{subscription['id']}"),
+                                            headers=headers, data=json.dumps({"webhook": {"id": subscription['id'], "address": address}}))
+                    if response.status_code != 200:
+                        shopify_connection._create_common_process_log_line(log_id, webhook.operations, webhook, response.text, f"Failed to update {webhook.operations} Shopify Webhook. Status code: {response.status_code}.", 'error')
+                        continue
+                    result = response.json().get('webhook')
+                    summary['updated'] += 1
+                    shopify_connection._create_common_process_log_line(log_id, webhook.operations, webhook, result, "Successfully updated webhook on Shopify.", 'success')
+                else:
+                    response = requests.post(shopify_instance_id._get_shopify_api_url('webhooks'), headers=headers, data=payload)
+                    if response.status_code != 201:
+                        shopify_connection._create_common_process_log_line(log_id, webhook.operations, webhook, response.text, f"Failed to create {webhook.operations} Shopify Webhook. Status code: {response.status_code}.", 'error')
+                        continue
+                    result = response.json().get('webhook')
+                    summary['created'] += 1
+                    shopify_connection._create_common_process_log_line(log_id, webhook.operations, webhook, result, "Successfully created webhook from Shopify.", 'success')
+                vals = {'webhook_id': str(result['id']), 'base_url': address, 'state': 'active'}
+                if any(webhook[field] != value for field, value in vals.items()):
+                    webhook.write(vals)
+
+            for subscription in obsolete + list(remote_by_topic.values()):
+                response = requests.delete(shopify_instance_id._get_shopify_api_url(f"webhooks/{subscription['id']}"), headers=headers)
+                if response.status_code not in (200, 404):
+                    shopify_connection._create_common_process_log_line(log_id, subscription.get('topic'), None, response.text, f"Failed to delete the webhook. HTTP Status Code: {response.status_code}", 'error')
+                    continue
+                summary['deleted'] += 1
+                shopify_connection._create_common_process_log_line(log_id, subscription.get('topic'), None, subscription, "Successfully deleted webhook from Shopify.", 'success')
+        except requests.RequestException as e:
+            shopify_connection._create_common_process_log_line(log_id, 'Error', None, str(e), 'Something went wrong while reconciling the webhooks', 'error')
+        _LOGGER.info("Reconciled webhooks of %s: %s", shopify_instance_id.name, summary)
+        return summary
 
+    @api.model
+    def cron_reconcile_shopify_webhooks(self):
+        """
+            Cron job method to reconcile the webhook subscriptions of every connected instance.
+        """
+        for shopify_instance_id in self.env['shopify.connector'].search([('state', '=', 'integrated')]):
+            self.reconcile_shopify_webhooks(shopify_instance_id)
+            self._cr.commit()
+        return True
 
     def shopify_operation_url_hook(self):
         """
             Get the corresponding route for the Shopify webhook operations.
             :return: Route based on the selected operation.
         """
-        operations = self.operations
-        route = ""
-        if operations == 'orders/create':
-            route += "/rcs_shopify_order_create_hook"
-        elif operations == 'orders/updated':
-            route += "/rcs_shopify_order_update_hook"
-        elif operations == 'customers/create':
-            route += "/rcs_shopify_customer_create_hook"
-        elif operations == 'customers/delete':
-            route += "/rcs_shopify_customer_delete_hook"
-        elif operations == 'customers/update':
-            route += "/rcs_shopify_customer_update_hook"
-        elif operations == 'products/create':
-            route += "/rcs_shopify_product_create_hook"
-        elif operations == 'products/update':
-            route += "/rcs_shopify_product_update_hook"
-        elif operations == 'products/delete':
-            route += "/rcs_shopify_product_delete_hook"
-        return route
+        return SHOPIFY_WEBHOOK_ROUTES.get(self.operations, "")
 
-    @api.model
     def unlink(self):
         """
             Override unlink method to delete Shopify webhook from Shopify store.
+            The records are removed first, then each instance is reconciled once, which deletes
+            the subscriptions of the removed operations.
             :return: Super call to parent unlink method.
-            :raises: ValidationError if something went wrong during webhook deletion.
         """
-        shopify_connection = self.env['shopify.connector']
-        connector_obj = self.env['shopify.operations.wizard']
-        for record in self:
-            if record.webhook_id:
-                shopify_instance_id = record.shopify_instance_id
-                url = record.delete_shopify_store_url_webhook(shopify_instance_id.shopify_host, shopify_instance_id)
-                headers = {
-                    'X-Shopify-Access-Token': shopify_instance_id.shopify_access_token
-                }
-                try:
-                    response = requests.request("DELETE", url, headers=headers)
-                    # Check response status for success
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        log_id = shopify_connection._create_common_process_log(f"Successfully deleted {record.operations} webhook from Shopify.", "shopify.webhook", record, response_data)
-                        log_line_id = shopify_connection._create_common_process_log_line(log_id, record.operations, record, response_data, f"Successfully deleted webhook from Shopify.", 'success')
-                        return super(ShopifyWebhook, self).unlink()
-                    else:
-                        raise ValidationError(f'Failed to delete the webhook.{response.text} HTTP Status Code: {response.status_code}')
-
-                except Exception as e:
-                    log_id = shopify_connection._create_common_process_log(f'Something went wrong while deleting the webhook {record.operations}', "shopify.webhook", record, str(e))
-                    log_line_id = shopify_connection._create_common_process_log_line(log_id, record.operations, record, str(e), 'Something went wrong while deleting the webhook', 'error')
-                    self._cr.commit()
-                    raise ValidationError(
-                        f'Something went wrong while deleting the webhook: {e}')
-            else:
-                return super(ShopifyWebhook, self).unlink()
-
-    def truncate_shopify_store_url_webhook(self, shopify_host, shopify_instance_id):
-        """
-            Generate Shopify webhook URL for creation.
-            :param shopify_host: Shopify store host URL.
-            :param shopify_instance_id: Shopify instance ID.
-            :return: Constructed Shopify webhook URL.
-        """
-        shop = shopify_host.split("//")
-        if len(shop) == 2:
-            shop_url = shop[0] + "//" + shop[1] + "/admin/api/" + shopify_instance_id.version_control + "/webhooks.json"
-        else:
-            shop_url = "https://" + shop[0] + "/admin/api/" + shopify_instance_id.version_control + "/webhooks.json"
-        return shop_url
-
-    def delete_shopify_store_url_webhook(self, shopify_host, shopify_instance_id):
-        """
-            Generate Shopify webhook deletion URL.
-            :param shopify_host: Shopify store host URL.
-            :param shopify_instance_id: Shopify instance ID.
-            :return: Constructed Shopify webhook deletion URL.
-        """
-        shop = shopify_host.split("//")
-        if len(shop) == 2:
-            shop_url = shop[0] + "//" + shop[1] + "/admin/api/" + shopify_instance_id.version_control + "/webhooks/" + self.webhook_id + ".json"
-        else:
-            shop_url = "https://" + shop[0] + "/admin/api/" + shopify_instance_id.version_control + "/webhooks/" + self.webhook_id + ".json"
-        return shop_url
+        shopify_instance_ids = self.filtered('webhook_id').shopify_instance_id
+        res = super(ShopifyWebhook, self).unlink()
+        for shopify_instance_id in shopify_instance_ids:
+            self.env['shopify.webhook'].reconcile_shopify_webhooks(shopify_instance_id)
+        return res
@@ -1,9 +1,250 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
+import logging
+from collections import defaultdict
+from datetime import timedelta
 from odoo import models, fields, api, _
+from odoo.tools.misc import split_every
+
+_logger = logging.getLogger(">>> Shopify Export Fulfillment <<<")
+
+# Requested cost per order: 1 + 2 + 5 * (1 + 2 + 20 * 2) = 218 points, so FULFILLMENT_BATCH_SIZE orders
+# stay under the 1000 points limit of a single query. Larger orders are completed page by page.
+FULFILLMENT_ORDERS_QUERY = """
+    %s: order(id: "gid://shopify/Order/%s") {
+        fulfillmentOrders(first: 5) {
+            pageInfo { hasNextPage endCursor }
+            nodes {
+                id
+                status
+                lineItems(first: 20) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes { id remainingQuantity lineItem { id } }
+                }
+            }
+        }
+    }
+"""
+FULFILLMENT_ORDERS_PAGE_QUERY = """
+    query ($order: ID!, $after: String) {
+        order(id: $order) {
+            fulfillmentOrders(first: 5, after: $after) {
+                pageInfo { hasNextPage endCursor }
+                nodes {
+                    id
+                    status
+                    lineItems(first: 20) {
+                        pageInfo { hasNextPage endCursor }
+                        nodes { id remainingQuantity lineItem { id } }
+                    }
+                }
+            }
+        }
+    }
+"""
+FULFILLMENT_LINE_ITEMS_PAGE_QUERY = """
+    query ($fulfillmentOrder: ID!, $after: String) {
+        fulfillmentOrder(id: $fulfillmentOrder) {
+            lineItems(first: 100, after: $after) {
+                pageInfo { hasNextPage endCursor }
+                nodes { id remainingQuantity lineItem { id } }
+            }
+        }
+    }
+"""
+FULFILLMENT_BATCH_SIZE = 4
+# Transient export failures are retried this many times before the picking is left for manual handling
+FULFILLMENT_MAX_RETRIES = 5
+# date_done is set when the validation starts, a batch validation can commit it later than the watermark moved
+FULFILLMENT_WATERMARK_LOOKBACK = timedelta(hours=1)
 
 
 class Location(models.Model):
     _inherit = 'stock.location'
 
-    shopify_location_id = fields.Char("Shopify Location id")
\ No newline at end of file
+    shopify_location_id = fields.Char("Shopify Location id", index=True)
+
+
+class StockPicking(models.Model):
+    _inherit = 'stock.picking'
+
+    shopify_fulfillment_id = fields.Char(string="Shopify Fulfillment ID", copy=False, readonly=True)
+    shopify_fulfillment_state = fields.Selection([('exported', 'Exported'), ('failed', 'Failed'), ('rejected', 'Rejected')],
+                                                 string="Shopify Fulfillment State", copy=False, readonly=True, index=True,
+                                                 help="Failed exports are retried, exports rejected by Shopify are not")
+    shopify_fulfillment_retry_count = fields.Integer(string="Fulfillment Export Retries", default=0, copy=False, readonly=True)
+
+    @api.model
+    def _get_shopify_fulfillment_mutation(self, instance_id):
+        """
+            Get the fulfillment mutation and input type supported by the API version of the instance.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :return: Tuple (mutation name, input type name).
+        """
+        if instance_id.version_control >= '2024-07':
+            return 'fulfillmentCreate', 'FulfillmentInput'
+        return 'fulfillmentCreateV2', 'FulfillmentV2Input'
+
+    def _prepare_shopify_fulfillment_input(self, fulfillment_orders):
+        """
+            Build the fulfillment input of all the pickings of one Shopify order.
+            Quantities of every picking are added up per Shopify line item and all tracking numbers
+            are sent together, so several deliveries of an order become a single fulfillment.
+            :param fulfillment_orders: Fulfillment order nodes returned by Shopify for the order.
+            :return: Fulfillment input dictionary or None when there is nothing left to fulfill.
+        """
+        quantities = defaultdict(float)
+        for move in self.move_ids.filtered(lambda m: m.state == 'done' and m.sale_line_id.shopify_order_line_id):
+            quantities[move.sale_line_id.shopify_order_line_id] += move.quantity
+
+        line_items_by_fulfillment_order = []
+        for fulfillment_order in fulfillment_orders:
+            if fulfillment_order.get('status') not in ('OPEN', 'IN_PROGRESS'):
+                continue
+            fulfillment_order_line_items = []
+            for line_item in fulfillment_order['lineItems']['nodes']:
+                shopify_line_id = line_item['lineItem']['id'].rsplit('/', 1)[-1]
+                quantity = min(int(quantities.get(shopify_line_id, 0)), line_item['remainingQuantity'])
+                if quantity > 0:
+                    fulfillment_order_line_items.append({'id': line_item['id'], 'quantity': quantity})
+                    quantities[shopify_line_id] -= quantity
+            if fulfillment_order_line_items:
+                line_items_by_fulfillment_order.append({
+                    'fulfillmentOrderId': fulfillment_order['id'],
+                    'fulfillmentOrderLineItems': fulfillment_order_line_items,
+                })
+        if not line_items_by_fulfillment_order:
+            return None
+
+        fulfillment_input = {
+            'lineItemsByFulfillmentOrder': line_items_by_fulfillment_order,
+            'notifyCustomer': True,
+        }
+        tracking_numbers = [picking.carrier_tracking_ref for picking in self if picking.carrier_tracking_ref]
+        if tracking_numbers:
+            tracking_info = {'numbers': tracking_numbers}
+            carrier = self.carrier_id[:1]
+            if carrier:
+                tracking_info['company'] = carrier.name
+            tracking_urls = [url for url in self.mapped('carrier_tracking_url') if url]
+            if tracking_urls:
+                tracking_info['urls'] = tracking_urls
+            fulfillment_input['trackingInfo'] = tracking_info
+        return fulfillment_input
+
+    @api.model
+    def _complete_shopify_fulfillment_orders(self, instance_id, order, order_data):
+        """
+            Fetch the fulfillment orders and line items of an order beyond the first page.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param order: sale.order record.
+            :param order_data: Order node returned by FULFILLMENT_ORDERS_QUERY.
+            :return: List of every fulfillment order node with all its line items.
+        """
+        connection = order_data.get('fulfillmentOrders') or {}
+        fulfillment_orders = list(connection.get('nodes') or [])
+        page_info = connection.get('pageInfo') or {}
+        while page_info.get('hasNextPage'):
+            data = instance_id._shopify_graphql(FULFILLMENT_ORDERS_PAGE_QUERY, {
+                'order': "gid://shopify/Order/%s" % order.shopify_order_id, 'after': page_info.get('endCursor')})
+            connection = ((data.get('order') or {}).get('fulfillmentOrders')) or {}
+            fulfillment_orders += connection.get('nodes') or []
+            page_info = connection.get('pageInfo') or {}
+        for fulfillment_order in fulfillment_orders:
+            line_items = fulfillment_order.get('lineItems') or {}
+            page_info = line_items.get('pageInfo') or {}
+            while page_info.get('hasNextPage'):
+                data = instance_id._shopify_graphql(FULFILLMENT_LINE_ITEMS_PAGE_QUERY, {
+                    'fulfillmentOrder': fulfillment_order['id'], 'after': page_info.get('endCursor')})
+                connection = ((data.get('fulfillmentOrder') or {}).get('lineItems')) or {}
+                line_items['nodes'] = (line_items.get('nodes') or []) + (connection.get('nodes') or [])
+                page_info = connection.get('pageInfo') or {}
+        return fulfillment_orders
+
+    def _export_shopify_fulfillments(self, instance_id, batch_size=FULFILLMENT_BATCH_SIZE):
+        """
+            Export validated deliveries of Shopify orders as fulfillments.
+            Pickings are grouped per order, the open fulfillment orders of a batch of orders are read
+            with one aliased query and their fulfillments created with one aliased mutation.
+            Fulfillments rejected by Shopify are not retried, other failures are retried a few times.
+            :param instance_id: Shopify instance ID (shopify.connector record).
+            :param batch_size: Number of orders sent per GraphQL call, bounded by the query cost limit.
+        """
+        shopify_connection = self.env['shopify.connector']
+        mutation_name, input_type = self._get_shopify_fulfillment_mutation(instance_id)
+        pickings_by_order = defaultdict(lambda: self.browse())
+        for picking in self:
+            pickings_by_order[picking.sale_id] |= picking
+
+        log_id = shopify_connection._create_common_process_log("Export fulfillments to Shopify.", "stock.picking")
+        for sale_orders in split_every(batch_size, list(pickings_by_order)):
+            try:
+                query = "query {%s}" % "".join(FULFILLMENT_ORDERS_QUERY % ("o%s" % order.id, order.shopify_order_id) for order in sale_orders)
+                fulfillment_orders = instance_id._shopify_graphql(query)
+
+                inputs = {}
+                for order in sale_orders:
+                    order_data = fulfillment_orders.get("o%s" % order.id) or {}
+                    fulfillment_input = pickings_by_order[order]._prepare_shopify_fulfillment_input(
+                        self._complete_shopify_fulfillment_orders(instance_id, order, order_data))
+                    if fulfillment_input:
+                        inputs[order] = fulfillment_input
+                    else:
+                        # Already fulfilled on Shopify
+                        pickings_by_order[order].write({'shopify_fulfillment_state': 'exported'})
+                if not inputs:
+                    continue
+
+                variables = {"f%s" % order.id: fulfillment_input for order, fulfillment_input in inputs.items()}
+                mutation = "mutation (%s) {%s}" % (
+                    ", ".join("$f%s: %s!" % (order.id, input_type) for order in inputs),
+                    "".join("f%s: %s(fulfillment: $f%s) { fulfillment { id status } userErrors { field message } }"
+                            % (order.id, mutation_name, order.id) for order in inputs))
+                results = instance_id._shopify_graphql(mutation, variables)
+                for order in inputs:
+                    result = results.get("f%s" % order.id) or {}
+                    pickings = pickings_by_order[order]
+                    if result.get('userErrors') or not result.get('fulfillment'):
+                        pickings.write({'shopify_fulfillment_state': 'rejected'})
+                        shopify_connection._create_common_process_log_line(log_id, order.name, order, result, f"Failed to export fulfillment of {order.name} order: {result.get('userErrors')}", 'error')
+                        continue
+                    fulfillment_id = result['fulfillment']['id'].rsplit('/', 1)[-1]
+                    pickings.write({'shopify_fulfillment_id': fulfillment_id, 'shopify_fulfillment_state': 'exported'})
+                    shopify_connection._create_common_process_log_line(log_id, order.name, order, result, f"Successfully exported fulfillment of {order.name} order to Shopify.", 'success')
+            except Exception as e:
+                _logger.error("Failed to export fulfillments to Shopify: %s", str(e), exc_info=True)
+                for order in sale_orders:
+                    for picking in pickings_by_order[order].filtered(lambda p: p.shopify_fulfillment_state != 'exported'):
+                        picking.write({'shopify_fulfillment_state': 'failed',
+                                       'shopify_fulfillment_retry_count': picking.shopify_fulfillment_retry_count + 1})
+                    shopify_connection._create_common_process_log_line(log_id, order.name, order, str(e), f"Failed to export fulfillment of {order.name} order.", 'error')
+
+    @api.model
+    def cron_export_shopify_fulfillments(self):
+        """
+            Cron job method to export to Shopify the deliveries validated since the watermark of each instance.
+            Failed exports are retried on the next runs up to FULFILLMENT_MAX_RETRIES times,
+            exports rejected by Shopify are left for manual handling. Deliveries are selected on their
+            export state, the watermark only bounds the scan with a lookback margin so deliveries
+            committed after a run are still exported.
+        """
+        for instance_id in self.env['shopify.connector'].search([('state', '=', 'integrated')]):
+            domain = [('sale_id.shopify_instance_id', '=', instance_id.id),
+                      ('picking_type_code', '=', 'outgoing'),
+                      ('state', '=', 'done'),
+                      ('shopify_fulfillment_id', '=', False)]
+            new_domain = [('shopify_fulfillment_state', '=', False)]
+            if instance_id.shopify_fulfillment_watermark:
+                new_domain = ['&'] + new_domain + [
+                    ('date_done', '>', instance_id.shopify_fulfillment_watermark - FULFILLMENT_WATERMARK_LOOKBACK)]
+            domain += ['|'] + new_domain + ['&', ('shopify_fulfillment_state', '=', 'failed'),
+                                            ('shopify_fulfillment_retry_count', '<', FULFILLMENT_MAX_RETRIES)]
+            pickings = self.search(domain, order='date_done, id')
+            if not pickings:
+                continue
+            _logger.info("Exporting %d deliveries of instance %s to Shopify.", len(pickings), instance_id.name)
+            pickings._export_shopify_fulfillments(instance_id)
+            instance_id.shopify_fulfillment_watermark = max([instance_id.shopify_fulfillment_watermark or pickings[0].date_done]
+                                                            + pickings.mapped('date_done'))
+            self._cr.commit()
+        return True